@@ -0,0 +1,125 @@
+import argparse, json, os, random, sys, tempfile, time
+import concurrent.futures as futures
+import multiprocessing as mp
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+import levelfile
+from levelfile import LevelFile
+from engine import Engine
+from game import LevelManager
+from replay import Replay
+from utils import summarize
+
+
+ACTIONS = [[], ["right"], ["right", "run"], ["right", "jump"], ["right", "run", "jump"], ["left"], ["jump"], ["up"]]
+
+# Set up once per worker process by start_worker
+worker = {}
+
+
+def random_script(frames, seed):
+    # Random actions held for a random number of frames, like someone mashing the controller
+    rng = random.Random(seed)
+    script = []
+    while len(script) < frames:
+        script += [rng.choice(ACTIONS)] * rng.randint(2, 30)
+    return script[:frames]
+
+
+def start_worker(file):
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    worker["engine"] = Engine((256, 224), headless = True)
+    # Mapped and parsed once, every level the worker plays is built from it
+    worker["file"] = LevelFile(file)
+
+
+def simulate(run):
+    # Plays one run to completion or run["frames"] frames, a death restarts the level
+    engine = worker["engine"]
+    engine.events.feed([])
+    random.seed(run["seed"])
+    if run.get("script"):
+        replay = Replay(run["script"])
+        random.seed(replay.seed)
+        frames = min(run["frames"], len(replay))
+    else:
+        replay = None
+        script = iter(random_script(run["frames"], run["seed"]))
+        frames = run["frames"]
+
+    # Through a LevelManager like main.py, so sessions recorded holding rewind play back the same
+    engine.root = manager = LevelManager([worker["file"]], rewind = replay.rewind if replay else 0)
+    engine.replay = replay
+    deaths = 0
+    dead = False
+    samples = []
+    clock = time.perf_counter
+    for frame in range(frames):
+        start = clock()
+        engine.step(1, None if replay else [next(script)])
+        samples.append(clock() - start)
+        level = manager.level
+        if level.complete():
+            break
+        if level.player.state.current("Dead") and not dead:
+            deaths += 1
+        dead = level.player.state.current("Dead")
+
+    result = dict(run, **{
+        "completed": manager.level.complete(),
+        "deaths": deaths,
+        "frames": len(samples),
+        "score": manager.level.player.score,
+        "frame": summarize(samples),
+        "worker": os.getpid()
+    })
+    manager.release()
+    return result
+
+
+def run_batch(file, runs, workers = None):
+    # Yields results in the order runs finish. Tiled levels are compiled once so every worker maps
+    # the same file instead of parsing JSON per run
+    with tempfile.TemporaryDirectory() as directory:
+        if file.endswith(".json"):
+            compiled = os.path.join(directory, "level.bin")
+            levelfile.compile_file(file, compiled)
+            file = compiled
+        context = mp.get_context("spawn")
+        with futures.ProcessPoolExecutor(
+            workers or os.cpu_count(), mp_context = context,
+            initializer = start_worker, initargs = (os.path.abspath(file),)
+        ) as pool:
+            for result in futures.as_completed([pool.submit(simulate, run) for run in runs]):
+                yield result.result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Run many headless playthroughs of a level across a process pool")
+    parser.add_argument("level", nargs = "?", default = "level.json")
+    parser.add_argument("--runs", type = int, default = 100, help = "randomized runs, seeded from --seed upwards")
+    parser.add_argument("--scripts", nargs = "+", default = [], help = "session logs to play back, one run each")
+    parser.add_argument("--frames", type = int, default = 3600)
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--workers", type = int, help = "worker processes, one per core by default")
+    args = parser.parse_args()
+
+    runs = [{"run": i, "seed": args.seed + i, "frames": args.frames} for i in range(args.runs)]
+    runs += [
+        {"run": args.runs + i, "seed": 0, "frames": args.frames, "script": os.path.abspath(script)}
+        for i, script in enumerate(args.scripts)
+    ]
+    start = time.perf_counter()
+    frames = completed = deaths = 0
+    for result in run_batch(args.level, runs, args.workers):
+        print(json.dumps(result), flush = True)
+        frames += result["frames"]
+        completed += result["completed"]
+        deaths += result["deaths"]
+    elapsed = time.perf_counter() - start
+    print("%d runs, %d completed, %d deaths, %d frames in %.1f s (%.0f frames/s)" % (
+        len(runs), completed, deaths, frames, elapsed, frames / elapsed
+    ), file = sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
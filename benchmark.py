@@ -0,0 +1,299 @@
+import argparse, contextlib, json, os, random, resource, sys, tempfile, time, tracemalloc
+import concurrent.futures as futures
+import multiprocessing as mp
+import utils, levelfile
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+from engine import Engine
+from game import Level, Goomba, pools
+from nodes import Tileset, Tilemap, Kinematic, SOLID
+from registry import assets
+
+
+PHASES = ["input", "physics", "process", "draw"]
+
+
+def top_solid_rows(data, width, height):
+    tileset = next(t for t in data["tilesets"] if t["name"] == "Ground")
+    solid = {t["id"] + 1 for t in tileset["tiles"] if t.get("type") in ("solid", "semisolid")}
+    tiles = next(l for l in data["layers"] if l["type"] == "tilelayer")["data"]
+    rows = {}
+    for i in range(width):
+        for j in range(height):
+            if tiles[j * width + i] in solid:
+                rows[i] = j
+                break
+    return rows
+
+
+def generate_level(template, scale, goombas, blocks, seed = 0):
+    rng = random.Random(seed)
+    data = json.loads(json.dumps(template))
+    width, height = template["width"], template["height"]
+    section = width * template["tilewidth"]
+
+    for layer in data["layers"]:
+        if layer["type"] == "tilelayer":
+            rows = [layer["data"][j * width:(j + 1) * width] for j in range(height)]
+            layer["data"] = [id for row in rows for id in row * scale]
+            layer["width"] = width * scale
+    data["width"] = width * scale
+
+    # Every copy of the map gets its own copy of the track
+    tracks = next(l for l in data["layers"] if l["name"] == "Tracks")
+    original = tracks["objects"][0]
+    tracks["objects"] = [
+        dict(original, id = data["nextobjectid"] + s, x = original["x"] + s * section)
+        for s in range(scale)
+    ]
+    data["nextobjectid"] += scale
+    path = [
+        {"x": p["x"] + s * section, "y": p["y"]}
+        for s in range(scale) for p in original["polyline"]
+    ]
+
+    entities = next(l for l in data["layers"] if l["name"] == "Entities")
+    block = next(e for e in entities["objects"] if e["type"] == "solid")
+    objects = [e for e in entities["objects"] if e["type"] != "solid" and e["name"] != "Goomba"]
+    next_id = data["nextobjectid"]
+
+    if blocks:
+        for n in range(blocks):
+            p = path[(n * len(path)) // blocks]
+            e = dict(block, id = next_id)
+            e["x"] = original["x"] + p["x"] - 8
+            e["y"] = original["y"] + p["y"] - 8
+            objects.append(e)
+            next_id += 1
+
+    ground = top_solid_rows(template, width, height)
+    columns = sorted(ground)
+    for n in range(goombas):
+        column = rng.choice(columns)
+        objects.append({
+            "height": 16, "id": next_id, "name": "Goomba", "rotation": 0, "type": "entity",
+            "visible": True, "width": 16,
+            "x": (rng.randrange(scale) * width + column) * 16,
+            "y": (ground[column] - 1) * 16
+        })
+        next_id += 1
+
+    entities["objects"] = objects
+    data["nextobjectid"] = next_id
+    return data
+
+
+def player_script(frames, seed):
+    rng = random.Random(seed)
+    for f in range(frames):
+        actions = {"right"}
+        if rng.random() < 0.1:
+            actions.add("jump")
+        yield actions
+
+
+def measure_entities(count = 1000):
+    # Bytes allocated per Goomba, and microseconds to spawn one new and from the pool
+    spawn = pools[Goomba].spawn
+    spawn((0, 0))
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    goombas = [Goomba((0, 0)) for _ in range(count)]
+    size = (tracemalloc.get_traced_memory()[0] - before) / count
+    tracemalloc.stop()
+    del goombas
+
+    start = time.perf_counter()
+    goombas = [Goomba((0, 0)) for _ in range(count)]
+    new = time.perf_counter() - start
+    for goomba in goombas:
+        pools[Goomba].release(goomba)
+    start = time.perf_counter()
+    goombas = [spawn((0, 0)) for _ in range(count)]
+    pooled = time.perf_counter() - start
+    return {"goomba_bytes": size, "spawn_us": new / count * 1e6, "pooled_spawn_us": pooled / count * 1e6}
+
+
+def check_sweep():
+    # A body flush against a solid row or column has to stop there at any speed, even one that
+    # moves it a whole tile or more in a step. Returns the moves that went through
+    Engine((256, 224), headless = True)
+    tileset = Tileset.from_tiled(utils.load_json("level.json"), "Ground")
+    tilemap = Tilemap(tileset, [20, 20], [[0] * 400])
+    tilemap.flags[5, :] = SOLID
+    tilemap.flags[:, 3] = SOLID
+    failures = []
+    for speed in (16, 20, 30, 47):
+        body = Kinematic((16, 16), (160, 64), gravity = False)
+        body.velocity.y = speed
+        body.move_and_collide(1, tilemap)
+        if body.shape.bottom != 80 or not body.grounded:
+            failures.append(("down", speed, body.shape.bottom))
+        body = Kinematic((16, 16), (32, 32), gravity = False)
+        body.velocity.x = speed
+        body.move_and_collide(1, tilemap)
+        if body.shape.right != 48:
+            failures.append(("right", speed, body.shape.right))
+    return failures
+
+
+def run_case(case):
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    with contextlib.redirect_stdout(sys.stderr):
+        return measure(case)
+
+
+def measure(case):
+    random.seed(case["seed"])
+    engine = Engine((256, 224), headless = True)
+    template = utils.load_json("level.json")
+    data = generate_level(template, case["scale"], case["goombas"], case["blocks"], case["seed"])
+
+    with tempfile.TemporaryDirectory() as directory:
+        file = os.path.join(directory, "level.json")
+        with open(file, "w") as f:
+            json.dump(data, f)
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        tileset = Tileset.from_tiled(data, "Ground")
+        layers = [l["data"] for l in data["layers"] if l["type"] == "tilelayer"]
+        start = time.perf_counter()
+        tilemap = Tilemap(tileset, [data["width"], data["height"]], layers)
+        bake = time.perf_counter() - start
+        del tilemap
+
+        compiled = os.path.join(directory, "level.bin")
+        levelfile.compile_file(file, compiled)
+        # Untimed, so the textures and sheets both loads share are already in the registry
+        Level.from_compiled(compiled, crowd = case.get("crowd", False))
+        start = time.perf_counter()
+        Level.from_compiled(compiled, crowd = case.get("crowd", False))
+        compiled_load = time.perf_counter() - start
+
+        start = time.perf_counter()
+        level = Level.from_tiled(file, crowd = case.get("crowd", False))
+        load = time.perf_counter() - start
+
+    timings = {phase: [] for phase in PHASES}
+    frames = []
+    clock = time.perf_counter
+    for actions in player_script(case["frames"], case["seed"]):
+        engine.events.feed(actions)
+        frame = clock()
+        start = clock()
+        level.input(engine.events)
+        timings["input"].append(clock() - start)
+        start = clock()
+        level.physics(1)
+        timings["physics"].append(clock() - start)
+        start = clock()
+        level.process()
+        timings["process"].append(clock() - start)
+        start = clock()
+        level.draw(engine.surface)
+        timings["draw"].append(clock() - start)
+        frames.append(clock() - frame)
+
+    return dict(case, **{
+        "map_size": [data["width"], data["height"]],
+        "entities": len(level.entity),
+        "tilemap_bake_ms": bake * 1000,
+        "level_load_ms": load * 1000,
+        "compiled_load_ms": compiled_load * 1000,
+        "phases": {phase: utils.summarize(timings[phase]) for phase in PHASES},
+        "frame": utils.summarize(frames),
+        "entity": measure_entities(),
+        "assets": assets.stats(),
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "load_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+    })
+
+
+def make_cases(scales, goombas, blocks, frames, seed, crowd = False):
+    return [
+        {
+            "name": "w%d-g%d-b%d%s" % (scale, g, b, "-crowd" if crowd else ""), "scale": scale,
+            "goombas": g, "blocks": b, "frames": frames, "seed": seed, "crowd": crowd
+        }
+        for scale in scales for g in goombas for b in blocks
+    ]
+
+
+def run(cases):
+    # Every case runs in a fresh interpreter so peak memory is not shared between them
+    context = mp.get_context("spawn")
+    results = []
+    for case in cases:
+        with futures.ProcessPoolExecutor(1, mp_context = context) as pool:
+            result = pool.submit(run_case, case).result()
+        print("%-20s load %8.1f ms  compiled %6.1f ms  frame p50 %6.2f ms  p95 %6.2f ms  rss %7d kb  goomba %5d b %5.1f us (pooled %4.1f us)" % (
+            result["name"], result["level_load_ms"], result["compiled_load_ms"], result["frame"]["p50_ms"],
+            result["frame"]["p95_ms"], result["peak_rss_kb"], result["entity"]["goomba_bytes"],
+            result["entity"]["spawn_us"], result["entity"]["pooled_spawn_us"]
+        ), file = sys.stderr)
+        results.append(result)
+    return results
+
+
+def compare(old, new, threshold):
+    baseline = {r["name"]: r for r in old["results"]}
+    regressions = []
+    for result in new["results"]:
+        previous = baseline.get(result["name"])
+        if not previous:
+            continue
+        metrics = [("tilemap_bake_ms", result["tilemap_bake_ms"], previous["tilemap_bake_ms"])]
+        metrics.append(("level_load_ms", result["level_load_ms"], previous["level_load_ms"]))
+        if "compiled_load_ms" in previous:
+            metrics.append(("compiled_load_ms", result["compiled_load_ms"], previous["compiled_load_ms"]))
+        metrics.append(("peak_rss_kb", result["peak_rss_kb"], previous["peak_rss_kb"]))
+        if "entity" in previous:
+            for metric in ("goomba_bytes", "spawn_us", "pooled_spawn_us"):
+                metrics.append((metric, result["entity"][metric], previous["entity"][metric]))
+        for phase in PHASES:
+            metrics.append((phase + ".p50_ms", result["phases"][phase]["p50_ms"], previous["phases"][phase]["p50_ms"]))
+        for metric, value, before in metrics:
+            change = (value - before) / before if before else 0
+            print("%-20s %-16s %10.2f -> %10.2f  %+6.1f%%" % (result["name"], metric, before, value, change * 100))
+            if change > threshold:
+                regressions.append((result["name"], metric, change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark Level simulation and rendering on synthetic maps")
+    parser.add_argument("--scales", type = int, nargs = "+", default = [1, 10, 100])
+    parser.add_argument("--goombas", type = int, nargs = "+", default = [0, 200, 1000])
+    parser.add_argument("--blocks", type = int, nargs = "+", default = [0, 200])
+    parser.add_argument("--frames", type = int, default = 300)
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--crowd", action = "store_true", help = "simulate Goombas as one vectorized Crowd")
+    parser.add_argument("--output", help = "write results as JSON to this file")
+    parser.add_argument("--compare", help = "previous results to compare against")
+    parser.add_argument("--threshold", type = float, default = 0.1)
+    args = parser.parse_args()
+
+    failures = check_sweep()
+    if failures:
+        for direction, speed, edge in failures:
+            print("tunneled: moving %s at %d ended at %d" % (direction, speed, edge), file = sys.stderr)
+        sys.exit(1)
+
+    results = run(make_cases(args.scales, args.goombas, args.blocks, args.frames, args.seed, args.crowd))
+    report = {"python": sys.version.split()[0], "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent = 1)
+    else:
+        json.dump(report, sys.stdout, indent = 1)
+        print()
+
+    if args.compare:
+        regressions = compare(utils.load_json(args.compare), report, args.threshold)
+        if regressions:
+            for name, metric, change in regressions:
+                print("regression: %s %s %+.1f%%" % (name, metric, change * 100), file = sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
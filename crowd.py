@@ -0,0 +1,182 @@
+import numpy as np
+import random, profiler
+from nodes import SOLID, SEMISOLID
+from registry import assets
+
+
+# Goomba-class walkers simulated together as arrays instead of one Kinematic each. They fall,
+# walk and turn around at walls like Goomba, but only collide with tiles and the player.
+class Crowd:
+    def __init__(self, positions, size = (16, 16), walk_speed = 1.0):
+        positions = np.asarray(positions, np.float64).reshape(-1, 2)
+        self.count = len(positions)
+        self.w, self.h = size
+        self.walk_speed = walk_speed
+        self.spritesheet = assets.spritesheet("assets/goomba.png", (16, 16))
+
+        self.x = positions[:, 0].copy()
+        self.y = positions[:, 1].copy()
+        self.sx = np.trunc(self.x).astype(np.int64)
+        self.sy = np.trunc(self.y).astype(np.int64)
+        self.vx = np.zeros(self.count)
+        self.vy = np.zeros(self.count)
+        self.grounded = np.zeros(self.count, bool)
+        self.moving_right = np.zeros(self.count, bool)
+        self.flip_h = np.zeros(self.count, bool)
+        self.flip_v = np.zeros(self.count, bool)
+        self.enabled = np.ones(self.count, bool)
+        self.dead = np.zeros(self.count, bool)
+        self.frame = np.zeros(self.count, np.int64)
+        self.active = np.ones(self.count, bool)
+        self.previous_x = self.sx.copy()
+        self.previous_y = self.sy.copy()
+        # Arrays that make up a snapshot, see save
+        self.state = [
+            self.x, self.y, self.sx, self.sy, self.vx, self.vy, self.grounded, self.moving_right,
+            self.flip_h, self.flip_v, self.enabled, self.dead, self.frame
+        ]
+        self.nbytes = sum(array.nbytes for array in self.state)
+
+    def release(self):
+        assets.release_asset(self.spritesheet)
+
+    def save(self, buffer, offset):
+        # Copies the state arrays into nbytes of buffer from offset, load copies them back in place
+        view = memoryview(buffer)
+        for array in self.state:
+            view[offset:offset + array.nbytes] = array.view(np.uint8)
+            offset += array.nbytes
+
+    def load(self, buffer, offset):
+        for array in self.state:
+            array[:] = np.frombuffer(buffer, array.dtype, len(array), offset)
+            offset += array.nbytes
+        self.previous_x[:] = self.sx
+        self.previous_y[:] = self.sy
+
+    def activate(self, region):
+        self.active = (
+            (self.sx < region.right) & (self.sx + self.w > region.left) &
+            (self.sy < region.bottom) & (self.sy + self.h > region.top)
+        )
+
+    def physics(self, tilemap):
+        self.previous_x[:] = self.sx
+        self.previous_y[:] = self.sy
+        active = self.active
+        self.vy[active] = np.minimum(self.vy[active] + 0.2, 10)
+
+        walking = active & self.enabled
+        turn = walking & (self.vx == 0)
+        self.moving_right[turn] = ~self.moving_right[turn]
+        self.flip_h[turn] = ~self.flip_h[turn]
+        self.vx[walking] = np.where(self.moving_right[walking], self.walk_speed, -self.walk_speed)
+        self.collide(tilemap, np.flatnonzero(walking))
+
+        falling = np.flatnonzero(active & self.dead)
+        self.x[falling] += self.vx[falling]
+        self.y[falling] += self.vy[falling]
+        self.sx[falling] = np.trunc(self.x[falling])
+        self.sy[falling] = np.trunc(self.y[falling])
+        profiler.count("collisions", 12 * len(falling))
+
+    def collide(self, tilemap, index):
+        # Same tile rules as Kinematic.move_and_collide, one probe point at a time for every walker
+        w, h = self.w, self.h
+        x, y, vx, vy = self.x[index] + self.vx[index], self.y[index], self.vx[index], self.vy[index]
+        sx, sy = np.trunc(x).astype(np.int64), self.sy[index]
+        profiler.count("collisions", 12 * len(index))
+
+        right = vx > 0
+        column = np.where(right, (sx + w) // 16, sx // 16)
+        for row in (sy // 16, (sy + h // 2) // 16, (sy + h) // 16):
+            hit = (tilemap.flags_at_points(column, row) & SOLID).astype(bool)
+            hit &= (sy + h != row * 16) & (sy != row * 16 + 16)
+            hit &= np.where(right, sx + w >= column * 16, sx <= column * 16 + 16)
+            sx = np.where(hit, np.where(right, column * 16 - w, column * 16 + 16), sx)
+            x = np.where(hit, sx, x)
+            vx = np.where(hit, 0, vx)
+
+        top = sy
+        y = y + vy
+        sy = np.trunc(y).astype(np.int64)
+        snap = np.where(self.grounded[index], 4, 0)
+        grounded = np.zeros(len(index), bool)
+        down = vy > 0
+        row = np.where(down, (sy + h + snap) // 16, sy // 16)
+        for column in (sx // 16, (sx + w // 2) // 16, (sx + w) // 16):
+            edge = (sx + w != column * 16) & (sx != column * 16 + 16)
+            bottom = sy + h + snap
+            flags = tilemap.flags_at_points(column, row)
+            solid = (flags & SOLID).astype(bool)
+            semisolid = (flags & SEMISOLID).astype(bool)
+            # Like the swept rule, semisolid tiles catch walkers that were no lower than their top 8
+            # pixels. Falling no faster than 10 (plus the snap) never skips a whole row
+            land = down & edge & (
+                (solid & (bottom >= row * 16)) |
+                (~solid & semisolid & (top + h <= row * 16 + 8) & (bottom >= row * 16))
+            )
+            bump = ~down & edge & solid & (sy <= row * 16 + 16)
+            sy = np.where(land, row * 16 - h, np.where(bump, row * 16 + 16, sy))
+            y = np.where(land | bump, sy, y)
+            vy = np.where(land, 0, np.where(bump, 1, vy))
+            grounded |= land
+
+        self.x[index], self.y[index], self.vx[index], self.vy[index] = x, y, vx, vy
+        self.sx[index], self.sy[index] = sx, sy
+        self.grounded[index] = grounded
+
+    def kill(self, i):
+        if self.enabled[i]:
+            self.flip_v[i] = True
+            self.vx[i] = 0
+            self.enabled[i] = False
+        elif not self.dead[i]:
+            self.dead[i] = True
+            self.vy[i] = -5
+            self.vx[i] = random.randint(-1, 1)
+
+    def process(self, player):
+        self.frame[self.active] += 1
+        if player.state.current("Dead"):
+            return
+        shape = player.shape
+        touching = np.flatnonzero(
+            ~self.dead & (self.sx < shape.right) & (self.sx + self.w > shape.left) &
+            (self.sy < shape.bottom + 1) & (self.sy + self.h > shape.top)
+        )
+        if not len(touching):
+            return
+        # Landing on a walker from above squashes it, touching a live one anywhere else kills
+        stomped = touching[(player.velocity.y >= 0) & (shape.bottom <= self.sy[touching] + self.h // 2)]
+        if len(stomped):
+            i = stomped[0]
+            self.kill(i)
+            player.score += 200
+            shape.bottom = self.sy[i]
+            player.position.y = shape.y
+            player.state.set("Jump")
+            player.velocity.y = -5
+        elif self.enabled[touching].any():
+            player.state.set("Dead")
+
+    def draw(self, surface, area, alpha = 1):
+        visible = np.flatnonzero(
+            (self.sx < area.right) & (self.sx + self.w > area.left) &
+            (self.sy < area.bottom) & (self.sy + self.h > area.top)
+        )
+        xs, ys = self.sx[visible], self.sy[visible]
+        if alpha != 1:
+            xs = np.rint(self.previous_x[visible] + (xs - self.previous_x[visible]) * alpha).astype(np.int64)
+            ys = np.rint(self.previous_y[visible] + (ys - self.previous_y[visible]) * alpha).astype(np.int64)
+        # Matches the two ten-frame "walk" animation Goomba plays
+        frames = (np.maximum(self.frame[visible] - 1, 0) % 20) // 10
+        get = self.spritesheet.get
+        surface.blits([
+            (get(frame, flip_h, flip_v), (x - area.x, y - area.y))
+            for frame, flip_h, flip_v, x, y in zip(
+                frames.tolist(), self.flip_h[visible].tolist(), self.flip_v[visible].tolist(),
+                xs.tolist(), ys.tolist()
+            )
+        ], False)
+        profiler.count("blits", len(visible))
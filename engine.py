@@ -1,37 +1,173 @@
 import pygame as pg
-import sys
+import sys, os
 
 
 class Engine:
-    def __init__(self, resolution, scale = 1):
+    def __init__(self, resolution, scale = 1, headless = False, filter = "nearest"):
+        self.headless = headless
+        if headless:
+            os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
         pg.init()
-        pg.display.set_caption("Super Mario")
 
         self.surface = pg.Surface(resolution)
-        self.screen = pg.display.set_mode(
-            (resolution[0] * scale, resolution[1] * scale), 0, 32
-        )
+        if headless:
+            # Images still need a display mode for convert_alpha, but nothing is presented
+            pg.display.set_mode((1, 1))
+            self.screen = None
+        else:
+            pg.display.set_caption("Super Mario")
+            self.screen = pg.display.set_mode(
+                (resolution[0] * scale, resolution[1] * scale), pg.RESIZABLE, 32
+            )
+        self.presenter = Presenter(self.surface, filter)
 
+        # framerate caps rendering (0 for uncapped), the simulation always advances in fixed
+        # steps of 1 / rate and catches up at most max_steps per rendered frame
         self.framerate = 60
+        self.rate = 60
+        self.timestep = 1 / self.rate
+        self.max_steps = 5
+        self.interpolate = True
         self.clock = pg.time.Clock()
-        self.dt = 0
+        self.dt = 1
+        self.frame = 0
 
         self.events = Events()
         self.root = None
+        self.profiler = None
+        self.recorder = None
+        self.replay = None
 
     def start(self):
+        accumulator = self.timestep
         while True:
+            self.begin_frame()
             self.events.update()
-            self.root.input(self.events)
-            self.root.physics(self.dt)
-            self.root.process()
-            self.root.draw(self.surface)
-            self.screen.blit(pg.transform.scale(self.surface, self.screen.get_size()), (0, 0))
-            self.tick()
+            if self.profiler and self.events.is_action_just_pressed("profiler"):
+                self.events.just_pressed.remove("profiler")
+                self.profiler.overlay = not self.profiler.overlay
+
+            steps = 0
+            while accumulator >= self.timestep and steps < self.max_steps:
+                self.simulate()
+                accumulator -= self.timestep
+                steps += 1
+            if accumulator >= self.timestep:
+                # Too far behind to catch up, drop the backlog instead of spiralling
+                accumulator %= self.timestep
+
+            self.root.draw(self.surface, accumulator / self.timestep if self.interpolate else 1)
+            self.mark("draw")
+            if self.profiler and self.profiler.overlay:
+                self.profiler.draw(self.surface)
+                self.mark("overlay")
+            self.presenter.present(pg.display.get_surface())
+            self.mark("present")
+            accumulator += self.tick()
+            self.mark("tick")
+            self.end_frame()
+
+    def step(self, n_frames = 1, inputs = None, draw = False):
+        inputs = iter(inputs) if inputs is not None else iter(())
+        for _ in range(n_frames):
+            self.begin_frame()
+            actions = next(inputs, None)
+            if actions is not None:
+                self.events.feed(actions)
+            else:
+                self.events.feed(self.events.pressed)
+            self.simulate()
+            if draw:
+                self.root.draw(self.surface)
+                self.mark("draw")
+            self.frame += 1
+            self.end_frame()
+        return self.frame
+
+    def simulate(self):
+        if self.replay:
+            actions = next(self.replay, None)
+            if actions is None:
+                self.replay = None
+            else:
+                self.events.load(*actions)
+        self.root.input(self.events)
+        self.mark("input")
+        self.root.physics(self.dt)
+        self.mark("physics")
+        self.root.process()
+        self.mark("process")
+        if self.recorder:
+            self.recorder.write(self.events, self.root.checksum())
+        self.events.consume()
+
+    def begin_frame(self):
+        if self.profiler:
+            self.profiler.begin()
+
+    def mark(self, phase):
+        if self.profiler:
+            self.profiler.mark(phase)
+
+    def end_frame(self):
+        if self.profiler:
+            self.profiler.end()
 
     def tick(self):
         pg.display.update()
-        self.dt = (self.clock.tick(self.framerate) * 0.001) * self.framerate
+        self.frame += 1
+        return self.clock.tick(self.framerate) * 0.001
+
+
+class Presenter:
+    # Scales the game surface into a letterboxed viewport of the window without allocating. The
+    # viewport is a subsurface of the display and, like the scratch buffer scale2x needs for
+    # larger scales, is only rebuilt when the window size changes. With integer the scale is the
+    # largest whole number that fits, filter is "nearest", "scale2x" or "smooth"
+    def __init__(self, surface, filter = "nearest", integer = True, background = (0, 0, 0)):
+        self.surface = surface
+        self.filter = filter
+        self.integer = integer
+        self.background = background
+        self.size = None
+        self.scale = 1
+        self.viewport = None
+        self.target = None
+        self.buffer = None
+        self.mode = filter
+
+    def layout(self, screen):
+        self.size = screen.get_size()
+        width, height = self.surface.get_size()
+        scale = min(self.size[0] / width, self.size[1] / height)
+        if self.integer and scale >= 1:
+            scale = int(scale)
+        self.scale = scale
+        self.viewport = pg.Rect(0, 0, max(1, int(width * scale)), max(1, int(height * scale)))
+        self.viewport.center = screen.get_rect().center
+        screen.fill(self.background)
+        self.target = screen.subsurface(self.viewport)
+        self.buffer = None
+        # scale2x only helps when upscaling at least twice
+        self.mode = "nearest" if self.filter == "scale2x" and scale < 2 else self.filter
+        if self.mode == "scale2x" and self.viewport.size != (width * 2, height * 2):
+            self.buffer = pg.Surface((width * 2, height * 2), 0, self.surface)
+
+    def present(self, screen):
+        if screen.get_size() != self.size:
+            self.layout(screen)
+        size = self.viewport.size
+        if size == self.surface.get_size():
+            self.target.blit(self.surface, (0, 0))
+        elif self.mode == "scale2x" and self.buffer is None:
+            pg.transform.scale2x(self.surface, self.target)
+        elif self.mode == "scale2x":
+            pg.transform.scale2x(self.surface, self.buffer)
+            pg.transform.scale(self.buffer, size, self.target)
+        elif self.mode == "smooth":
+            pg.transform.smoothscale(self.surface, size, self.target)
+        else:
+            pg.transform.scale(self.surface, size, self.target)
 
 
 class Events:
@@ -44,15 +180,15 @@ class Events:
             pg.K_z: "jump",
             pg.K_x: "spin",
             pg.K_a: "run",
-            pg.K_s: "interact"
+            pg.K_s: "interact",
+            pg.K_r: "rewind",
+            pg.K_F3: "profiler"
         }
         self.pressed = []
         self.just_pressed = []
         self.just_released = []
 
     def update(self):
-        self.just_pressed = []
-        self.just_released = []
         for event in pg.event.get():
             if event.type is pg.QUIT:
                 pg.quit()
@@ -66,6 +202,23 @@ class Events:
                     if action in self.pressed: self.pressed.remove(action)
                     if action not in self.just_released: self.just_released.append(action)
 
+    def consume(self):
+        # Called after every simulation step, so a press is seen by exactly one step even when a
+        # rendered frame runs several steps or none
+        self.just_pressed = []
+        self.just_released = []
+
+    def load(self, pressed, just_pressed, just_released):
+        self.pressed = list(pressed)
+        self.just_pressed = list(just_pressed)
+        self.just_released = list(just_released)
+
+    def feed(self, actions):
+        pressed = [action for action in self.mappings.values() if action in actions]
+        self.just_pressed = [action for action in pressed if action not in self.pressed]
+        self.just_released = [action for action in self.pressed if action not in pressed]
+        self.pressed = pressed
+
     def is_action_just_released(self, action):
         if action in self.just_released:
             return True
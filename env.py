@@ -0,0 +1,199 @@
+import os, random, tempfile
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+import pygame as pg
+import levelfile
+from engine import Engine
+from game import Level, Goomba
+
+
+ACTIONS = [
+    [], ["right"], ["right", "run"], ["right", "jump"], ["right", "run", "jump"],
+    ["left"], ["left", "jump"], ["jump"], ["up"], ["down"]
+]
+RESOLUTION = (256, 224)
+# Extra bit set in tile observations where an enemy is, next to the tile flags from nodes
+ENEMY = 128
+
+
+def observation_shape(observation, crop = (16, 16)):
+    if observation == "pixels":
+        return (RESOLUTION[1], RESOLUTION[0], 4)
+    return (crop[1], crop[0])
+
+
+class MarioEnv:
+    # One Level behind a reset() / step(action) interface. Observations are written in place into
+    # buffer (a uint8 array of observation_shape, allocated here if not given): "pixels" are RGBX
+    # frames drawn straight into it, "tiles" are tile flags around the player plus ENEMY bits
+    def __init__(self, level = "level.json", observation = "tiles", crop = (16, 16), frame_skip = 4, max_frames = 3600, buffer = None):
+        self.file = level
+        self.kind = observation
+        self.crop = crop
+        self.frame_skip = frame_skip
+        self.max_frames = max_frames
+        if buffer is None:
+            buffer = np.zeros(observation_shape(observation, crop), np.uint8)
+        self.observation = buffer
+
+        self.engine = Engine(RESOLUTION, headless = True)
+        if observation == "pixels":
+            self.engine.surface = pg.image.frombuffer(buffer, RESOLUTION, "RGBX")
+        self.level = None
+
+    def reset(self, seed = None):
+        random.seed(seed)
+        if self.level:
+            self.level.release()
+        self.level = self.engine.root = Level.load(self.file)
+        self.engine.events.feed([])
+        self.frames = 0
+        self.progress = self.level.player.position.x
+        self.score = 0
+        self.observe()
+        return self.observation
+
+    def step(self, action):
+        level = self.level
+        self.engine.step(self.frame_skip, [ACTIONS[action]] * self.frame_skip)
+        self.frames += self.frame_skip
+
+        # Reward moving right past the furthest point so far, scoring, and finishing, punish dying
+        x = level.player.position.x
+        reward = max(x - self.progress, 0) / 16 + (level.player.score - self.score) / 100
+        self.progress = max(self.progress, x)
+        self.score = level.player.score
+        dead = level.player.state.current("Dead")
+        complete = level.complete()
+        if dead:
+            reward -= 10
+        elif complete:
+            reward += 100
+        done = dead or complete or self.frames >= self.max_frames
+
+        self.observe()
+        return self.observation, reward, done, {"frames": self.frames, "score": self.score, "complete": complete}
+
+    def observe(self):
+        if self.kind == "pixels":
+            self.level.draw(self.engine.surface)
+            return
+        tilemap = self.level.tilemap
+        size = tilemap.tileset.size
+        w, h = self.crop
+        x0 = self.level.player.shape.centerx // size - w // 2
+        y0 = self.level.player.shape.centery // size - h // 2
+        out = self.observation
+        out.fill(0)
+        # Copy the part of the window that overlaps the map
+        sx0, sy0 = max(x0, 0), max(y0, 0)
+        sx1, sy1 = min(x0 + w, tilemap.width), min(y0 + h, tilemap.height)
+        if sx0 < sx1 and sy0 < sy1:
+            out[sy0 - y0:sy1 - y0, sx0 - x0:sx1 - x0] = tilemap.flags[sy0:sy1, sx0:sx1]
+        for entity in self.level.active:
+            if isinstance(entity, Goomba) and entity.enabled:
+                self.mark(entity.shape.centerx // size - x0, entity.shape.centery // size - y0)
+        crowd = self.level.crowd
+        if crowd:
+            for x, y in zip(crowd.sx[crowd.enabled].tolist(), crowd.sy[crowd.enabled].tolist()):
+                self.mark((x + crowd.w // 2) // size - x0, (y + crowd.h // 2) // size - y0)
+
+    def mark(self, x, y):
+        if 0 <= x < self.crop[0] and 0 <= y < self.crop[1]:
+            self.observation[y, x] |= ENEMY
+
+
+def run_worker(connection, names, start, end, n, shape, options):
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    blocks = [shared_memory.SharedMemory(name = name) for name in names]
+    observations, rewards, dones, actions = shared_arrays(blocks, n, shape)
+    envs = [MarioEnv(buffer = observations[i], **options) for i in range(start, end)]
+    while True:
+        command, seed = connection.recv()
+        if command == "reset":
+            for i, env in enumerate(envs, start):
+                env.reset(None if seed is None else seed + i)
+        elif command == "step":
+            for i, env in enumerate(envs, start):
+                _, rewards[i], dones[i], _ = env.step(int(actions[i]))
+                if dones[i]:
+                    env.reset()
+        elif command == "close":
+            break
+        connection.send(None)
+    del observations, rewards, dones, actions
+    for block in blocks:
+        block.close()
+
+
+def shared_arrays(blocks, n, shape):
+    return (
+        np.ndarray((n,) + shape, np.uint8, blocks[0].buf),
+        np.ndarray(n, np.float32, blocks[1].buf),
+        np.ndarray(n, np.bool_, blocks[2].buf),
+        np.ndarray(n, np.int32, blocks[3].buf)
+    )
+
+
+class VectorEnv:
+    # n MarioEnvs spread over worker processes. Observations, rewards, done flags and actions
+    # live in shared memory, so only a short command goes through each pipe per step and the
+    # arrays returned are the shared buffers themselves. An environment that is done is reset
+    # right away and its observation is the first of the next episode
+    def __init__(self, n, workers = None, **options):
+        self.n = n
+        # Workers reset often, so a Tiled level is compiled once for all of them to map
+        self.directory = tempfile.TemporaryDirectory()
+        level = os.path.abspath(options.get("level", "level.json"))
+        if level.endswith(".json"):
+            compiled = os.path.join(self.directory.name, "level.bin")
+            levelfile.compile_file(level, compiled)
+            level = compiled
+        options = dict(options, level = level)
+        shape = observation_shape(options.get("observation", "tiles"), options.get("crop", (16, 16)))
+        sizes = [n * int(np.prod(shape)), n * 4, n, n * 4]
+        self.blocks = [shared_memory.SharedMemory(create = True, size = max(size, 1)) for size in sizes]
+        self.observations, self.rewards, self.dones, self.actions = shared_arrays(self.blocks, n, shape)
+
+        context = mp.get_context("spawn")
+        workers = max(1, min(workers or os.cpu_count(), n))
+        self.connections = []
+        self.processes = []
+        for w in range(workers):
+            start, end = n * w // workers, n * (w + 1) // workers
+            parent, child = context.Pipe()
+            process = context.Process(
+                target = run_worker, daemon = True,
+                args = (child, [block.name for block in self.blocks], start, end, n, shape, options)
+            )
+            process.start()
+            self.connections.append(parent)
+            self.processes.append(process)
+
+    def command(self, command, argument = None):
+        for connection in self.connections:
+            connection.send((command, argument))
+        for connection in self.connections:
+            connection.recv()
+
+    def reset(self, seed = None):
+        self.command("reset", seed)
+        return self.observations
+
+    def step(self, actions):
+        self.actions[:] = actions
+        self.command("step")
+        return self.observations, self.rewards, self.dones
+
+    def close(self):
+        for connection in self.connections:
+            connection.send(("close", None))
+        for process in self.processes:
+            process.join()
+        del self.observations, self.rewards, self.dones, self.actions
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.directory.cleanup()
@@ -1,7 +1,18 @@
 import pygame as pg
-import utils, random
-from nodes import Root, Tileset, Tilemap, Kinematic, AnimatedSprite, Spritesheet, Camera, StateMachine, Font
-from states import Walk, Idle, Jump, Fall, ClimbIdle, ClimbMove, Skid, Dead
+import utils, profiler, struct, zlib
+from registry import assets
+from crowd import Crowd
+from hud import HUD
+from track import TrackNetwork
+from concurrent.futures import ThreadPoolExecutor
+from levelfile import LevelFile
+from rewind import Rewind
+from nodes import Root, Tileset, Tilemap, Kinematic, Animations, AnimatedSprite, Camera, StateMachine, Font, SpatialHash, Pool, LADDER, DAMAGE
+from states import Walk, Idle, Jump, Fall, ClimbIdle, ClimbMove, Skid, Dead, Patrol, Squashed, Knocked
+
+
+# Values of FollowCamera.fixed
+FIXED = (None, "left", "right")
 
 
 class FollowCamera(Camera):
@@ -37,121 +48,471 @@ class FollowCamera(Camera):
         if self.snap_limits()[0]:
             self.fixed = None
 
+    def save(self, out):
+        out += (self.shape.x, self.shape.y, FIXED.index(self.fixed))
+
+    def load(self, values, i):
+        self.shape.x = int(values[i])
+        self.shape.y = int(values[i + 1])
+        self.fixed = FIXED[int(values[i + 2])]
+        return i + 3
+
 
 class Level(Root):
-    def __init__(self, tilemap, player, entities = [], track = []):
+    # The HUD timer starts at TIME_LIMIT and ticks down once every TIME_UNIT frames. It is only
+    # shown, running out does nothing
+    TIME_LIMIT = 400
+    TIME_UNIT = 40
+
+    def __init__(self, tilemap, player, entities = [], tracks = None, activation_margin = 64, crowd = None):
         self.tilemap = tilemap
-        self.track = track
+        self.tracks = tracks or TrackNetwork([])
         self.player = player
         self.entity = entities
+        self.crowd = crowd
         self.camera = FollowCamera(self.player, (256, 224), self.tilemap.size)
-
-        self.surface = pg.Surface(self.tilemap.size, pg.HWSURFACE + pg.SRCALPHA)
-        self.entities = pg.Surface(self.tilemap.size, pg.HWSURFACE + pg.SRCALPHA)
-
-        self.surface.blit(self.tilemap.surface, (0, 0))
+        self.grid = SpatialHash()
+        for entity in self.entity:
+            self.grid.insert(entity)
+        self.activation_margin = activation_margin
+        self.awake = [entity for entity in self.entity if entity.activation == "always"]
+        self.active = []
+        # Where things were before the last simulation step, for interpolated drawing
+        self.previous = {}
+        self.previous_camera = self.camera.shape.topleft
+        self.frames = 0
+        self.hud = HUD()
+        # Snapshots refer to bodies by their index here, the player is last
+        self.bodies = self.entity + [self.player]
+        self.ids = {body: i for i, body in enumerate(self.bodies)}
+        self.snapshot_format = None
+        self.spans = []
+        # Values the level is known to still be in, from the last snapshot or restore until the next step
+        self.saved = None
 
     @classmethod
-    def from_tiled(cls, file):
+    def from_tiled(cls, file, crowd = False):
         level = utils.load_json(file)
+        tilemap = Tilemap.from_tiled(level)
+        # Objects of infinite maps are shifted along with the tiles
+        ox, oy = tilemap.offset
 
         entities = next(l for l in level["layers"] if l["name"] == "Entities")
         player = next(e for e in entities["objects"] if e["name"] == "Player")
 
         track_data = next(l for l in level["layers"] if l["name"] == "Tracks")
-        track = [pg.Vector2(p["x"] + track_data["objects"][0]["x"], p["y"] + track_data["objects"][0]["y"]) for p in track_data["objects"][0]["polyline"]]
+        tracks = [
+            [(p["x"] + track["x"] + ox, p["y"] + track["y"] + oy) for p in track["polyline"]]
+            for track in track_data["objects"] if "polyline" in track
+        ]
 
-        tilemap = Tilemap.from_tiled(level)
-        player = Player((player["x"], player["y"]))
-        blocks = [
-            Block(
-                (e["x"], e["y"]), tilemap.tileset.tiles[e["gid"] - 1]
-            ) for e in entities["objects"] if e["type"] == "solid"
-        ] + [Goomba((196, 144))]
-        return cls(tilemap, player, blocks, track)
+        return cls.spawn(
+            tilemap, (player["x"] + ox, player["y"] + oy),
+            [((e["x"] + ox, e["y"] + oy), e["gid"]) for e in entities["objects"] if e["type"] == "solid"],
+            [(e["x"] + ox, e["y"] + oy) for e in entities["objects"] if e["name"] == "Goomba"],
+            tracks, crowd
+        )
+
+    @classmethod
+    def from_compiled(cls, file, crowd = False):
+        # Loads a level written by levelfile.py, the tile layers stay in the mapped file. file is
+        # a path or a LevelFile that is already open, to build many levels from one mapping
+        level = file if isinstance(file, LevelFile) else LevelFile(file)
+        tileset = level.tileset
+        tilemap = Tilemap(
+            Tileset(
+                tileset["image"], tileset["size"], tileset["tiles"],
+                tileset["margin"], tileset["spacing"], tileset["colorkey"]
+            ),
+            (level.width, level.height), level.layers
+        )
+        player = level.spawns("player")[0]
+        return cls.spawn(
+            tilemap, (float(player["x"]), float(player["y"])),
+            [((x, y), gid) for x, y, gid in level.spawns("block")[["x", "y", "gid"]].tolist()],
+            level.spawns("goomba")[["x", "y"]].tolist(),
+            level.tracks, crowd
+        )
+
+    @classmethod
+    def load(cls, file, crowd = False):
+        if isinstance(file, str) and file.endswith(".json"):
+            return cls.from_tiled(file, crowd)
+        return cls.from_compiled(file, crowd)
+
+    @classmethod
+    def spawn(cls, tilemap, player, blocks, goombas, tracks, crowd = False):
+        player = pools[Player].spawn(player)
+        tracks = TrackNetwork.from_polylines(tracks)
+        blocks = [pools[Block].spawn(position, tilemap.tileset.tiles[gid - 1]) for position, gid in blocks]
+        # With crowd every Goomba is simulated in one vectorized Crowd instead of as an entity
+        if crowd:
+            return cls(tilemap, player, blocks, tracks, crowd = Crowd(goombas))
+        return cls(tilemap, player, blocks + [pools[Goomba].spawn(position) for position in goombas], tracks)
+
+    def release(self):
+        # Gives the bodies back to be reused by the next level spawned, the level must not be
+        # played afterwards
+        for body in self.bodies:
+            pools[type(body)].release(body)
+        self.bodies = []
+        # and the references to assets the level took, so collect can free what no level uses
+        self.tilemap.tileset.release()
+        self.hud.release()
+        if self.crowd:
+            self.crowd.release()
+
+    def bake(self):
+        # Decodes and renders what the first frames will show, so a level loaded on a worker
+        # starts without a stall
+        view = self.camera.shape.copy()
+        view.center = self.player.shape.center
+        view.clamp_ip(pg.Rect((0, 0), self.tilemap.size))
+        view.inflate_ip(2 * self.activation_margin, 2 * self.activation_margin)
+        self.tilemap.stream(view)
+        self.tilemap.prerender(view)
+
+    def complete(self):
+        return self.player.shape.left >= self.tilemap.size[0]
+
+    def failed(self):
+        return self.player.state.current("Dead") and self.player.timer >= 180
 
     def input(self, events):
+        self.saved = None
         self.player.input(events)
 
+    def update_activation(self):
+        region = self.camera.shape.inflate(2 * self.activation_margin, 2 * self.activation_margin)
+        self.tilemap.stream(region)
+        if self.crowd:
+            self.crowd.activate(region)
+        active = set(self.awake)
+        for entity in self.grid.query(region):
+            if entity not in active and region.colliderect(entity.shape):
+                active.add(entity)
+                if entity.activation == "wake":
+                    self.awake.append(entity)
+        self.active = sorted(active, key = self.grid.order.__getitem__)
+
     def physics(self, dt):
-        for entity in self.entity:
+        self.saved = None
+        self.update_activation()
+        self.previous = {entity: entity.shape.topleft for entity in self.active}
+        self.previous[self.player] = self.player.shape.topleft
+        self.previous_camera = self.camera.shape.topleft
+        for entity in self.active:
             entity.apply_gravity()
             if isinstance(entity, Block):
-                entity.physics(dt, self.tilemap, self.track)
+                entity.physics(dt, self.tilemap, self.tracks)
             else:
-                entity.physics(dt, self.tilemap, self.entity)
+                entity.physics(dt, self.tilemap, self.grid)
+            self.grid.update(entity)
+        if self.crowd:
+            self.crowd.physics(self.tilemap)
         self.player.apply_gravity()
-        self.player.physics(dt, self.tilemap, self.entity)
+        self.player.physics(dt, self.tilemap, self.grid)
 
     def process(self):
-        for entity in self.entity:
+        for entity in self.active:
             if isinstance(entity, Goomba):
                 entity.process()
+        if self.crowd:
+            self.crowd.process(self.player)
         self.player.process()
         self.camera.process()
 
-    def draw(self, surface):
-        surface.fill((0,120,255))
-        self.entities.fill((0, 0, 0, 0))
+        self.frames += 1
+        self.update_hud()
+
+    def update_hud(self):
+        self.hud.set("time", max(self.TIME_LIMIT - self.frames // self.TIME_UNIT, 0))
+        self.hud.set("score", self.player.score)
+
+    def checksum(self):
+        # Hash of where everything is, recorded per step so replays can be checked for divergence
+        positions = [self.player.position.x, self.player.position.y]
         for entity in self.entity:
-            entity.draw(self.entities)
-        self.player.draw(self.entities)
-        self.camera.draw(surface, [self.surface, self.entities])
+            positions += [entity.position.x, entity.position.y]
+        checksum = zlib.crc32(struct.pack(f"<{len(positions)}d", *positions))
+        if self.crowd:
+            checksum = zlib.crc32(self.crowd.x.tobytes(), checksum)
+            checksum = zlib.crc32(self.crowd.y.tobytes(), checksum)
+        return checksum
+
+    def save(self):
+        # Everything that changes while playing as one flat list of numbers, always as many for
+        # a level. Snapshots copy the crowd's arrays in after it, the global random state is left out
+        values = [self.frames]
+        self.camera.save(values)
+        for body in self.bodies:
+            body.save(values, self)
+        awake = set(self.awake)
+        values += [entity in awake for entity in self.entity]
+        return values
+
+    def snapshot_size(self):
+        if self.snapshot_format is None:
+            values = [self.frames]
+            self.camera.save(values)
+            # Where each body's values are
+            for body in self.bodies:
+                start = len(values)
+                body.save(values, self)
+                self.spans.append((body, start, len(values)))
+            # and an awake flag for each entity
+            self.snapshot_format = struct.Struct(f"<{len(values) + len(self.entity)}d")
+        return self.snapshot_format.size + (self.crowd.nbytes if self.crowd else 0)
+
+    def snapshot(self, buffer = None, offset = 0):
+        # Writes the level state into snapshot_size bytes of buffer from offset, or a new buffer
+        size = self.snapshot_size()
+        if buffer is None:
+            buffer = bytearray(size)
+        values = self.save()
+        self.snapshot_format.pack_into(buffer, offset, *values)
+        self.saved = tuple(values)
+        if self.crowd:
+            self.crowd.save(buffer, offset + self.snapshot_format.size)
+        return buffer
+
+    def restore(self, buffer, offset = 0):
+        # Puts the level back in the state a snapshot of it was taken in
+        self.snapshot_size()
+        values = self.snapshot_format.unpack_from(buffer, offset)
+        self.frames = int(values[0])
+        self.camera.load(values, 1)
+        # Stepping back while rewinding mostly finds bodies as they were, those are left alone
+        saved = self.saved
+        for body, start, end in self.spans:
+            if saved is None or values[start:end] != saved[start:end]:
+                body.load(values, start, self)
+                if body is not self.player:
+                    self.grid.update(body)
+        self.awake = [entity for entity, awake in zip(self.entity, values[end:]) if awake]
+        self.saved = values
+        if self.crowd:
+            self.crowd.load(buffer, offset + self.snapshot_format.size)
+        # Nothing to interpolate from until the next step
+        self.previous = {}
+        self.previous_camera = self.camera.shape.topleft
+        self.update_hud()
+
+    def interpolate(self, previous, current, alpha):
+        return (
+            round(utils.lerp(previous[0], current[0], alpha)),
+            round(utils.lerp(previous[1], current[1], alpha))
+        )
+
+    def offset(self, entity, camera, alpha):
+        # Drawing with this offset puts the entity between its last two simulated positions
+        previous = self.previous.get(entity)
+        if alpha == 1 or previous is None:
+            return camera.topleft
+        x, y = self.interpolate(previous, entity.shape.topleft, alpha)
+        return camera.x + entity.shape.x - x, camera.y + entity.shape.y - y
+
+    def draw(self, surface, alpha = 1):
+        camera = self.camera.shape
+        if alpha != 1:
+            camera = camera.copy()
+            camera.topleft = self.interpolate(self.previous_camera, self.camera.shape.topleft, alpha)
+        surface.fill((0,120,255))
+        self.camera.draw(surface, [self.tilemap], camera)
+        # Sprites can be larger than their shape, so the culling rect gets a tile of slack
+        view = camera.inflate(32, 32)
+        visible = [entity for entity in self.grid.query(view) if view.colliderect(entity.shape)]
+        for entity in sorted(visible, key = self.grid.order.__getitem__):
+            entity.draw(surface, self.offset(entity, camera, alpha))
+        if self.crowd:
+            self.crowd.draw(surface, camera, alpha)
+        self.player.draw(surface, self.offset(self.player, camera, alpha))
+        self.hud.draw(surface)
+
+
+class LevelManager(Root):
+    # Plays levels in order. The next level, and a fresh copy of the current one once the player
+    # dies, are loaded and baked on a worker thread so switching is only a handoff. With rewind
+    # the last that many steps are kept and holding the "rewind" action plays them backwards,
+    # across a restart too since the fresh copy takes snapshots of the same level
+    def __init__(self, files, crowd = False, rewind = 0):
+        self.files = files
+        self.crowd = crowd
+        self.rewind = Rewind(rewind) if rewind else None
+        self.rewinding = False
+        self.index = 0
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix = "levels")
+        self.level = self.load(files[0])
+        self.upcoming = self.preload(1)
+        self.restart = None
+
+    def load(self, file):
+        level = Level.load(file, self.crowd)
+        level.bake()
+        return level
+
+    def preload(self, index):
+        if index < len(self.files):
+            return self.executor.submit(self.load, self.files[index])
+
+    def input(self, events):
+        self.rewinding = self.rewind is not None and events.is_action_pressed("rewind")
+        if not self.rewinding:
+            self.level.input(events)
+
+    def physics(self, dt):
+        if not self.rewinding:
+            self.level.physics(dt)
+
+    def process(self):
+        if self.rewinding:
+            self.rewind.back(self.level)
+            return
+        self.level.process()
+        if self.rewind is not None:
+            self.rewind.record(self.level)
+        if self.level.complete() and self.upcoming:
+            self.level.release()
+            self.level = self.upcoming.result()
+            assets.collect()
+            self.index += 1
+            self.upcoming = self.preload(self.index + 1)
+            self.restart = None
+            if self.rewind is not None:
+                self.rewind.clear()
+        elif self.level.player.state.current("Dead"):
+            if self.restart is None:
+                self.restart = self.preload(self.index)
+            if self.level.failed():
+                self.level.release()
+                self.level = self.restart.result()
+                assets.collect()
+                self.restart = None
+
+    def draw(self, surface, alpha = 1):
+        self.level.draw(surface, alpha)
+
+    def checksum(self):
+        return self.level.checksum()
+
+    def release(self):
+        # Lets go of the current level and of any loaded ahead, once the manager is done with
+        self.level.release()
+        for future in (self.upcoming, self.restart):
+            if future:
+                future.result().release()
+        self.executor.shutdown()
 
 
 class Block(Kinematic):
+    activation = "always"
+    __slots__ = ("sprite", "forward", "track", "index", "point", "distance", "steering", "speed")
+
     def __init__(self, position, sprite):
         Kinematic.__init__(self, (16, 16), position, False)
+        self.speed = 1
+        self.reset(position, sprite)
+
+    def reset(self, position, sprite):
+        Kinematic.reset(self, position, False)
         self.sprite = sprite
         self.forward = True
+        self.track = None
         self.index = None
         self.point = None
-        self.speed = 1
+        self.distance = 0
+        self.steering = False
 
-    def physics(self, dt, tilemap, track):
-        self.update(track)
+    def physics(self, dt, tilemap, tracks):
+        self.update(tracks)
         if self.gravity:
             self.move_and_collide(dt, tilemap)
         else:
             self.move(dt)
 
-    def update(self, path):
+    def update(self, tracks):
         center = self.position + pg.Vector2(self.shape.w / 2, self.shape.h / 2)
-        rounded_center = pg.Vector2((self.position.x // 16) * 16 + 8, (self.position.y // 16) * 16 + 8)
 
         if not self.point:
-            if rounded_center in path:
-                self.point = rounded_center
-                self.index = path.index(rounded_center)
+            found = tracks.at(self.position)
+            if found:
+                self.track, self.index = found
+                self.point = self.track.points[self.index]
+                self.distance = 0
+                # A block that catches the track away from the point steers towards the next point
+                # until it reaches it, from then on it rides the precomputed segments
+                self.steering = center != self.point
 
         if self.forward:
-            if self.index + 1 >= len(path):
+            if self.track is None or self.index + 1 >= len(self.track):
                 self.gravity = True
                 self.point = None
-            else:
-                next_index = self.index + 1
-                next = path[next_index]
+            elif self.steering:
+                next = self.track.points[self.index + 1]
                 direction = next - center
                 self.velocity = direction if direction.length() <= self.speed else direction.normalize() * self.speed
                 if center + self.velocity == next:
                     self.point = next
-                    self.index = next_index
+                    self.index += 1
+                    self.steering = False
+            elif self.track.lengths[self.index] - self.distance <= self.speed:
+                # The last step of a segment lands exactly on its end point
+                self.index += 1
+                self.point = self.track.points[self.index]
+                self.velocity = self.point - center
+                self.distance = 0
+            else:
+                self.velocity = self.track.directions[self.index] * self.speed
+                self.distance += self.speed
+
+    def save(self, out, level):
+        Kinematic.save(self, out, level)
+        out += (
+            level.tracks.tracks.index(self.track) if self.track is not None else -1,
+            -1 if self.index is None else self.index,
+            self.point is not None, self.distance, self.steering, self.forward
+        )
+
+    def load(self, values, i, level):
+        i = Kinematic.load(self, values, i, level)
+        track, index, point, self.distance, steering, forward = values[i:i + 6]
+        self.track = level.tracks.tracks[int(track)] if track >= 0 else None
+        self.index = int(index) if index >= 0 else None
+        # The point a block is at is always the one at its index
+        self.point = self.track.points[self.index] if point else None
+        self.steering = bool(steering)
+        self.forward = bool(forward)
+        return i + 6
 
-    def draw(self, surface):
-        surface.blit(self.sprite, self.shape.topleft)
+    def draw(self, surface, offset = (0, 0)):
+        surface.blit(self.sprite, (self.shape.x - offset[0], self.shape.y - offset[1]))
+        profiler.count("blits")
 
 
 class Goomba(Kinematic):
+    __slots__ = ("sprite", "moving_right", "walk_speed", "enabled", "dead", "state")
+    ANIMATIONS = Animations({
+        "walk": [{"frame": 0, "duration": 10}, {"frame": 1, "duration": 10}]
+    })
+
     def __init__(self, position, moving_right=True):
         Kinematic.__init__(self, (16, 16), position)
-        self.sprite = AnimatedSprite(Spritesheet("assets/goomba.png", (16, 16)), {
-            "walk": [{"frame": 0, "duration": 10}, {"frame": 1, "duration": 10}]
-        }, "walk")
-        self.moving_right = not moving_right
+        self.sprite = AnimatedSprite(assets.spritesheet("assets/goomba.png", (16, 16)), self.ANIMATIONS, "walk")
         self.walk_speed = 1.0
+        self.state = StateMachine(self, [Patrol, Squashed, Knocked], "Patrol")
+        self.reset(position, moving_right)
+
+    def reset(self, position, moving_right=True):
+        Kinematic.reset(self, position)
+        self.sprite.reset("walk")
+        self.state.reset("Patrol")
+        self.moving_right = not moving_right
         self.enabled = True
         self.dead = False
 
+    def free(self):
+        assets.release_asset(self.sprite.spritesheet)
+
     def process(self):
         self.sprite.next()
 
@@ -169,44 +530,69 @@ class Goomba(Kinematic):
             self.enabled_collisions = False
             self.move(dt)
 
-    def draw(self, surface):
-        x = self.shape.x - (self.sprite.texture.get_width() - self.shape.w) / 2
-        y = self.shape.y - (self.sprite.texture.get_height() - self.shape.h)
+    def draw(self, surface, offset = (0, 0)):
+        x = self.shape.x - (self.sprite.texture.get_width() - self.shape.w) / 2 - offset[0]
+        y = self.shape.y - (self.sprite.texture.get_height() - self.shape.h) - offset[1]
         self.sprite.draw(surface, (x, y))
 
+    def save(self, out, level):
+        Kinematic.save(self, out, level)
+        self.sprite.save(out)
+        out += (self.state.id, self.moving_right, self.enabled, self.dead)
+
+    def load(self, values, i, level):
+        i = self.sprite.load(values, Kinematic.load(self, values, i, level))
+        state, moving_right, enabled, dead = values[i:i + 4]
+        self.state.id = int(state)
+        self.moving_right = bool(moving_right)
+        self.enabled = bool(enabled)
+        self.dead = bool(dead)
+        return i + 4
+
     def kill(self):
-        if self.enabled:
-            self.sprite.flip_v = True
-            self.velocity.x = 0
-            self.enabled = False
-        elif not self.dead:
-            self.dead = True
-            self.velocity.y = -5
-            self.velocity.x = random.randint(-1, 1)
-            print(self.velocity.x)
+        if self.state.current(Patrol):
+            self.state.set(Squashed)
+        elif self.state.current(Squashed):
+            self.state.set(Knocked)
 
 
 class Player(Kinematic):
+    __slots__ = (
+        "sprite", "state", "near", "input_velocity", "timer", "walk_max_speed", "walk_acceleration", "score"
+    )
+    ANIMATIONS = Animations({
+        "idle": [{"frame": 0, "duration": 1}],
+        "walk": [{"frame": 3, "duration": 6}, {"frame": 4, "duration": 6}],
+        "run": [{"frame": 3, "duration": 3}, {"frame": 4, "duration": 3}],
+        "max_speed": [{"frame": 3, "duration": 3}, {"frame": 4, "duration": 3}],
+        "jump": [{"frame": 7, "duration": 1}],
+        "fall": [{"frame": 8, "duration": 1}],
+        "climb_idle": [{"frame": 10, "duration": 1}],
+        "climb_move": [{"frame": 11, "duration": 6}, {"frame": 12, "duration": 6}],
+        "skid": [{"frame": 13, "duration": 1}],
+        "dead": [{"frame": 14, "duration": 6}, {"frame": 15, "duration": 6}]
+    })
+
     def __init__(self, position):
         Kinematic.__init__(self, (12, 16), position)
-        self.sprite = AnimatedSprite(Spritesheet("assets/mario.png", (16, 24)), {
-            "idle": [{"frame": 0, "duration": 1}],
-            "walk": [{"frame": 3, "duration": 6}, {"frame": 4, "duration": 6}],
-            "run": [{"frame": 3, "duration": 3}, {"frame": 4, "duration": 3}],
-            "max_speed": [{"frame": 3, "duration": 3}, {"frame": 4, "duration": 3}],
-            "jump": [{"frame": 7, "duration": 1}],
-            "fall": [{"frame": 8, "duration": 1}],
-            "climb_idle": [{"frame": 10, "duration": 1}],
-            "climb_move": [{"frame": 11, "duration": 6}, {"frame": 12, "duration": 6}],
-            "skid": [{"frame": 13, "duration": 1}],
-            "dead": [{"frame": 14, "duration": 6}, {"frame": 15, "duration": 6}]
-        }, "idle")
+        self.sprite = AnimatedSprite(assets.spritesheet("assets/mario.png", (16, 24)), self.ANIMATIONS, "idle")
         self.state = StateMachine(self, [Idle, Walk, Skid, Jump, Fall, ClimbIdle, ClimbMove, Dead], "Idle")
-        self.near = []
         self.input_velocity = pg.Vector2(0, 0)
-        self.timer = None
         self.walk_max_speed = 1.5
         self.walk_acceleration = 0.05
+        self.reset(position)
+
+    def reset(self, position):
+        Kinematic.reset(self, position)
+        self.sprite.reset("idle")
+        self.state.reset("Idle")
+        self.near = []
+        self.input_velocity.update(0)
+        self.timer = None
+        self.score = 0
+
+    def free(self):
+        assets.release_asset(self.sprite.spritesheet)
 
     def process(self):
         top = self.colliding.get("top")
@@ -215,6 +601,7 @@ class Player(Kinematic):
         right = self.colliding.get("right")
         if isinstance(bottom, Goomba) and not bottom.dead:
             bottom.kill()
+            self.score += 200
             self.state.set("Jump")
             self.velocity.y = -5
         if isinstance(right, Goomba) or isinstance(left, Goomba) or isinstance(top, Goomba):
@@ -283,11 +670,28 @@ class Player(Kinematic):
             -self.walk_max_speed, self.walk_max_speed
         )
 
-    def draw(self, surface):
-        x = self.shape.x - (self.sprite.texture.get_width() - self.shape.w) / 2
-        y = self.shape.y - (self.sprite.texture.get_height() - self.shape.h)
+    def draw(self, surface, offset = (0, 0)):
+        x = self.shape.x - (self.sprite.texture.get_width() - self.shape.w) / 2 - offset[0]
+        y = self.shape.y - (self.sprite.texture.get_height() - self.shape.h) - offset[1]
         self.sprite.draw(surface, (x, y))
 
+    def save(self, out, level):
+        Kinematic.save(self, out, level)
+        self.sprite.save(out)
+        out += (
+            self.state.id, "ladder" in self.near, self.input_velocity.x, self.input_velocity.y,
+            -1 if self.timer is None else self.timer, self.score
+        )
+
+    def load(self, values, i, level):
+        i = self.sprite.load(values, Kinematic.load(self, values, i, level))
+        state, ladder, self.input_velocity.x, self.input_velocity.y, timer, score = values[i:i + 6]
+        self.state.id = int(state)
+        self.near = ["ladder"] if ladder else []
+        self.timer = int(timer) if timer >= 0 else None
+        self.score = int(score)
+        return i + 6
+
     def is_near(self, tag):
         return tag in self.near
 
@@ -302,11 +706,15 @@ class Player(Kinematic):
         for point in points:
             x = point[0] // 16
             y = point[1] // 16
-            tile = tilemap.get_info_at(x, y)
-            if tile:
-                if tile.has("ladder"):
+            flags = tilemap.flags_at(x, y)
+            if flags:
+                if flags & LADDER:
                     self.near.append("ladder")
-                if tile.has("damage"):
+                if flags & DAMAGE:
                     self.state.set("Dead")
         if self.shape.top > tilemap.size[1]:
             self.state.set("Dead")
+
+
+# Bodies of released levels, spawned again by the levels loaded after them
+pools = {Block: Pool(Block), Goomba: Pool(Goomba), Player: Pool(Player)}
@@ -0,0 +1,65 @@
+import pygame as pg
+import nodes, profiler
+from registry import assets
+
+
+HUD_TEXTURE = "assets/hud.png"
+HUD_COLORKEY = (147, 187, 236)
+# Pieces of hud.png: name -> area in the sheet
+HUD_PIECES = {
+    "mario": (267, 1, 40, 8),
+    "item_box": (115, 10, 28, 28),
+    "time": (153, 16, 24, 7)
+}
+TRANSPARENT = (255, 0, 255)
+
+
+class HUD:
+    # Everything is composed into one colorkeyed band, static pieces once and each field again
+    # only when its value changes, so drawing it is a single blit of a surface that already exists
+    def __init__(self, width = 256, height = 40):
+        self.font = assets.font("assets/font.png", (8, 8), nodes.FONT_CHARACTERS)
+        self.surface = pg.Surface((width, height))
+        self.surface.fill(TRANSPARENT)
+        self.surface.set_colorkey(TRANSPARENT, pg.RLEACCEL)
+        self.fields = {}
+        self.values = {}
+        self.changed = set()
+
+        self.texture = assets.texture(HUD_TEXTURE, HUD_COLORKEY)
+        self.piece("mario", (24, 15))
+        self.piece("item_box", (114, 11))
+        self.piece("time", (152, 15))
+
+        self.field("time", (152, 23), 3)
+        self.field("score", (192, 23), 7)
+
+    def piece(self, name, position):
+        self.surface.blit(self.texture, position, HUD_PIECES[name])
+
+    def release(self):
+        assets.release_asset(self.font)
+        assets.release_asset(self.texture)
+
+    def field(self, name, position, width):
+        # A right aligned run of width characters
+        self.fields[name] = (pg.Rect(position, (width * self.font.size[0], self.font.size[1])), width)
+        self.values[name] = None
+
+    def set(self, name, value):
+        if self.values[name] != value:
+            self.values[name] = value
+            self.changed.add(name)
+
+    def update(self):
+        for name in self.changed:
+            area, width = self.fields[name]
+            self.surface.fill(TRANSPARENT, area)
+            self.surface.blit(self.font.render(str(self.values[name]).rjust(width)[-width:]), area)
+            profiler.count("hud fields")
+        self.changed.clear()
+
+    def draw(self, surface):
+        self.update()
+        surface.blit(self.surface, (0, 0))
+        profiler.count("blits")
@@ -0,0 +1,131 @@
+import argparse, json, mmap, struct
+import numpy as np
+import utils, tiled
+
+
+# A compiled level is a header, a JSON block with the tileset and map metadata and then 8 byte
+# aligned arrays that are memory-mapped on load: the tile layers, the entity spawn table and the
+# track polylines. Offsets of every array are listed in the metadata.
+MAGIC = b"SMWL"
+VERSION = 1
+HEADER = struct.Struct("<4sHI")
+KINDS = ["player", "goomba", "block"]
+SPAWN = np.dtype([("kind", "u1"), ("gid", "<u4"), ("x", "<f8"), ("y", "<f8")])
+
+
+def align(n):
+    return (n + 7) & ~7
+
+
+def compile_tiled(data, tileset_name = "Ground"):
+    tileset = next(t for t in data["tilesets"] if t["name"] == tileset_name)
+    width, height = data["width"], data["height"]
+    if data.get("infinite"):
+        raise ValueError("only finite maps can be compiled")
+    layers = np.array([
+        tiled.decode(l["data"], l.get("encoding"), l.get("compression"))
+        for l in data["layers"] if l["type"] == "tilelayer"
+    ], "<u4")
+
+    entities = next(l for l in data["layers"] if l["name"] == "Entities")
+    spawns = []
+    for e in entities["objects"]:
+        if e["name"] == "Player":
+            spawns.append((KINDS.index("player"), 0, e["x"], e["y"]))
+        elif e["name"] == "Goomba":
+            spawns.append((KINDS.index("goomba"), 0, e["x"], e["y"]))
+        elif e["type"] == "solid":
+            spawns.append((KINDS.index("block"), e["gid"], e["x"], e["y"]))
+
+    tracks, offsets = [], [0]
+    for layer in data["layers"]:
+        if layer["name"] == "Tracks":
+            for track in layer["objects"]:
+                if "polyline" not in track:
+                    continue
+                tracks += [(p["x"] + track["x"], p["y"] + track["y"]) for p in track["polyline"]]
+                offsets.append(len(tracks))
+
+    arrays = {
+        "layers": layers.reshape(-1, height, width),
+        "spawns": np.array(spawns, SPAWN),
+        "tracks": np.array(tracks, "<f8").reshape(-1, 2),
+        "track_offsets": np.array(offsets, "<u4")
+    }
+    metadata = {
+        "width": width,
+        "height": height,
+        "tileset": {
+            "image": tileset["image"], "size": tileset["tilewidth"], "tiles": tileset["tiles"],
+            "margin": tileset["margin"], "spacing": tileset["spacing"],
+            "colorkey": tileset["transparentcolor"]
+        },
+        "arrays": {}
+    }
+
+    # Array offsets are relative to the first 8 byte boundary after the metadata
+    offset = 0
+    for name, array in arrays.items():
+        metadata["arrays"][name] = [offset, array.dtype.descr if array.dtype.names else array.dtype.str, list(array.shape)]
+        offset = align(offset + array.nbytes)
+
+    header = json.dumps(metadata).encode()
+    out = bytearray(HEADER.pack(MAGIC, VERSION, len(header)) + header)
+    out += bytes(align(len(out)) - len(out))
+    start = len(out)
+    for name, array in arrays.items():
+        out += bytes(start + metadata["arrays"][name][0] - len(out))
+        out += array.tobytes()
+    return bytes(out)
+
+
+def compile_file(source, destination):
+    data = compile_tiled(utils.load_json(source))
+    with open(destination, "wb") as f:
+        f.write(data)
+    return len(data)
+
+
+class LevelFile:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        magic, version, length = HEADER.unpack_from(self.buffer)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} compiled level")
+        metadata = json.loads(self.buffer[HEADER.size:HEADER.size + length])
+        self.width = metadata["width"]
+        self.height = metadata["height"]
+        self.tileset = metadata["tileset"]
+        self.arrays = {}
+        start = align(HEADER.size + length)
+        for name, (offset, dtype, shape) in metadata["arrays"].items():
+            dtype = np.dtype([tuple(field) for field in dtype] if isinstance(dtype, list) else dtype)
+            count = int(np.prod(shape))
+            self.arrays[name] = np.frombuffer(self.buffer, dtype, count, start + offset).reshape(shape)
+
+    @property
+    def layers(self):
+        # Flat views straight into the mapped file, indexing them gives plain ints
+        return [memoryview(layer.reshape(-1)) for layer in self.arrays["layers"]]
+
+    def spawns(self, kind):
+        spawns = self.arrays["spawns"]
+        return spawns[spawns["kind"] == KINDS.index(kind)]
+
+    @property
+    def tracks(self):
+        points, offsets = self.arrays["tracks"], self.arrays["track_offsets"].tolist()
+        return [points[start:end].tolist() for start, end in zip(offsets, offsets[1:])]
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Compile a Tiled JSON level into a binary level file")
+    parser.add_argument("source")
+    parser.add_argument("destination")
+    args = parser.parse_args()
+    print(f"{args.destination}: {compile_file(args.source, args.destination)} bytes")
+
+
+if __name__ == "__main__":
+    main()
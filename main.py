@@ -1,13 +1,68 @@
 import pygame as pg
+import argparse, random, sys
 from engine import Engine
-from game import Level
+from game import LevelManager
+from profiler import Profiler
+from replay import Recorder, Replay, verify
+from nodes import StateTable
+
+
+def print_state_traces():
+    for table in StateTable.tables.values():
+        for row in table.report():
+            print("%-10s -> %-10s checks %8d  passed %6d  transitions %6d" % row)
 
 
 def main():
-    engine = Engine((256, 224), 2)
-    level = Level.from_tiled("level.json")
-    engine.root = level
-    engine.start()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profile", action = "store_true", help = "show the frame profiler overlay (toggle with F3)")
+    parser.add_argument("--trace", help = "write a Chrome trace of the last frames to this file on exit")
+    parser.add_argument("--level", nargs = "+", default = ["level.json"], help = "Tiled JSON or compiled levels to play in order")
+    parser.add_argument("--record", help = "write the session's input to this log")
+    parser.add_argument("--replay", help = "play back the input from this log instead of the keyboard")
+    parser.add_argument("--verify", action = "store_true", help = "with --replay, run headless and check the positions match the recording")
+    parser.add_argument("--scale", type = int, default = 2, help = "initial window scale")
+    parser.add_argument("--filter", choices = ["nearest", "scale2x", "smooth"], default = "nearest", help = "upscaling filter")
+    parser.add_argument("--rewind", type = float, default = 0, help = "seconds of play to keep for rewinding (hold R)")
+    parser.add_argument("--trace-states", action = "store_true", help = "count state checks and transitions, printed on exit")
+    args = parser.parse_args()
+    StateTable.tracing = args.trace_states
+
+    if args.replay and args.verify:
+        engine = Engine((256, 224), headless = True)
+        replay = Replay(args.replay)
+        engine.root = LevelManager(args.level, rewind = replay.rewind)
+        frame = verify(engine, replay)
+        if frame is None:
+            print(f"{len(replay)} frames replayed identically")
+        else:
+            print(f"replay diverged at frame {frame}")
+            sys.exit(1)
+        return
+
+    engine = Engine((256, 224), args.scale, filter = args.filter)
+    rewind = int(args.rewind * engine.rate)
+    if args.replay:
+        engine.replay = Replay(args.replay)
+        random.seed(engine.replay.seed)
+        rewind = engine.replay.rewind
+    elif args.record:
+        seed = random.getrandbits(32)
+        random.seed(seed)
+        engine.recorder = Recorder(args.record, engine.events.mappings.values(), seed, rewind)
+    engine.root = LevelManager(args.level, rewind = rewind)
+    if args.profile or args.trace:
+        engine.profiler = Profiler(overlay = args.profile, trace_frames = 3600 if args.trace else 0)
+        engine.profiler.enable()
+    try:
+        engine.start()
+    finally:
+        if args.trace_states:
+            print_state_traces()
+        if engine.recorder:
+            engine.recorder.close()
+        if args.trace:
+            engine.profiler.export_trace(args.trace)
 
 
 if __name__ == "__main__":
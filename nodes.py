@@ -1,4 +1,10 @@
 import pygame as pg
+import numpy as np
+import profiler, registry, tiled
+from bisect import bisect_right
+from collections import OrderedDict
+from itertools import accumulate
+from concurrent.futures import ThreadPoolExecutor
 
 class Root:
     def input(self, events):
@@ -10,25 +16,58 @@ class Root:
     def process(self):
         pass
 
-    def draw(self, surface):
+    def draw(self, surface, alpha = 1):
         pass
 
+    def checksum(self):
+        return 0
+
+
+FONT_CHARACTERS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ.,x-!$@=:"
+
 
 class Font:
-    def __init__(self, file, size, characters):
-        self.characters = {}
+    def __init__(self, file, size, characters, cache_size = 64):
         self.size = size
-        texture = pg.image.load(file).convert_alpha()
+        # Glyphs are areas of the font texture, so whole strings go out in one blits call
+        self.texture = registry.assets.texture(file)
+        self.glyphs = {}
+        self.characters = {}
         for x, char in enumerate(characters):
             clip = pg.Rect(x * size[0], 0, size[0], size[1])
-            self.characters[char] = texture.subsurface(clip)
+            self.glyphs[char] = clip
+            self.characters[char] = self.texture.subsurface(clip)
+        # Strings drawn with render are kept until cache_size newer strings have been used
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+
+    def blits(self, text, position = (0, 0)):
+        x, y = position
+        return [
+            (self.texture, (x + i * self.size[0], y), self.glyphs[char])
+            for i, char in enumerate(text) if char in self.glyphs
+        ]
 
     def write(self, text):
         surface = pg.Surface((self.size[0] * len(text), self.size[1]), pg.HWSURFACE + pg.SRCALPHA)
-        for x, char in enumerate(text):
-            surface.blit(self.characters[char], (x * self.size[0], 0))
+        surface.blits(self.blits(text), False)
         return surface
 
+    def render(self, text):
+        # Like write, but the surface is shared with every other caller and must not be changed
+        surface = self.cache.get(text)
+        if surface is None:
+            surface = self.cache[text] = self.write(text)
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last = False)
+        else:
+            self.cache.move_to_end(text)
+        return surface
+
+    def draw(self, surface, text, position):
+        surface.blits(self.blits(text, position), False)
+        profiler.count("blits", len(text))
+
 
 class State:
     def __init__(self, transitions, states):
@@ -45,30 +84,102 @@ class State:
         pass
 
 
+class StateTable:
+    # Ids and transitions of one list of State classes, compiled once and shared by every machine
+    # built from the same list. Transitions are (target id, check) pairs in the list's order
+    tables = {}
+    tracing = False
+
+    def __init__(self, states):
+        self.names = [state.__name__ for state in states]
+        self.ids = {}
+        for id, state in enumerate(states):
+            self.ids[state] = self.ids[state.__name__] = id
+        self.states = [state(states) for state in states]
+        self.transitions = [
+            tuple((self.ids[target], target.check) for target in state.transitions)
+            for state in self.states
+        ]
+        # With tracing on, (from, to) -> [checks evaluated, checks passed, transitions made]
+        self.counts = {}
+
+    @classmethod
+    def compile(cls, states):
+        key = tuple(states)
+        table = cls.tables.get(key)
+        if table is None:
+            table = cls.tables[key] = cls(states)
+        return table
+
+    def count(self, source, target, index, n = 1):
+        counts = self.counts.get((source, target))
+        if counts is None:
+            counts = self.counts[(source, target)] = [0, 0, 0]
+        counts[index] += n
+
+    def report(self):
+        return [
+            (self.names[source], self.names[target], checks, passed, changes)
+            for (source, target), (checks, passed, changes) in sorted(
+                self.counts.items(), key = lambda item: -item[1][0]
+            )
+        ]
+
+
 class StateMachine:
+    __slots__ = ("entity", "table", "id")
+
     def __init__(self, entity, states, state):
         self.entity = entity
-        self.states = {s.__name__:s(states) for s in states}
-        self.state = self.states[state]
+        self.table = StateTable.compile(states)
+        self.reset(state)
+
+    def reset(self, state):
+        # Starts over in state without entering it, like a new machine
+        self.id = self.table.ids[state]
+
+    @property
+    def state(self):
+        return self.table.states[self.id]
 
     def process(self):
-        for state in self.state.transitions:
-            change_state = state.check(self.entity)
-            if change_state:
-                self.set(state.__name__)
+        if StateTable.tracing:
+            return self.process_traced()
+        for target, check in self.table.transitions[self.id]:
+            if check(self.entity):
+                self.change(target)
                 break
 
-    def set(self, state_name):
-        state = self.states.get(state_name)
-        if state and self.state != state:
-            self.state.exit(self.entity)
-            self.state = state
-            self.state.enter(self.entity)
+    def process_traced(self):
+        source = self.id
+        for target, check in self.table.transitions[source]:
+            self.table.count(source, target, 0)
+            profiler.count("state checks")
+            if check(self.entity):
+                self.table.count(source, target, 1)
+                self.change(target)
+                break
+
+    def set(self, state):
+        id = self.table.ids.get(state)
+        if id is not None and id != self.id:
+            self.change(id)
+
+    def change(self, id):
+        if StateTable.tracing:
+            self.table.count(self.id, id, 2)
+        states = self.table.states
+        states[self.id].exit(self.entity)
+        self.id = id
+        states[id].enter(self.entity)
 
     def current(self, state):
-        if self.state == self.states.get(state):
-            return True
-        return False
+        return self.id == self.table.ids.get(state)
+
+
+SOLID, SEMISOLID, TRACK, LADDER, DAMAGE, COIN, BOUNCE = 1, 2, 4, 8, 16, 32, 64
+TYPE_FLAGS = {"solid": SOLID, "semisolid": SEMISOLID, "track": TRACK}
+TAG_FLAGS = {"ladder": LADDER, "damage": DAMAGE, "coin": COIN, "bounce": BOUNCE}
 
 
 class Tile:
@@ -80,6 +191,9 @@ class Tile:
             for property in properties:
                 if property["type"] == "bool":
                     self.tags.append(property["name"])
+        self.flags = TYPE_FLAGS.get(self.type, 0)
+        for tag in self.tags:
+            self.flags |= TAG_FLAGS.get(tag, 0)
         self.points = []
         objectgroup = data.get("objectgroup")
         if objectgroup:
@@ -98,17 +212,16 @@ class Tile:
 
 class Tileset:
     def __init__(self, texture, size, data, margin = 0, spacing = 0, colorkey = None):
-        self.texture = pg.image.load(texture).convert_alpha()
-        self.texture.set_colorkey(colorkey)
+        self.texture = registry.assets.texture(texture, colorkey)
         self.size = size
         self.data = {}
         for tile in data:
             self.data[tile["id"]] = Tile(tile)
-        self.tiles = []
-        for j in range(margin, self.texture.get_height(), size + spacing):
-            for i in range(margin, self.texture.get_width(), size + spacing):
-                clip = pg.Rect(i, j, size, size)
-                self.tiles.append(self.texture.subsurface(clip))
+        self.tiles = registry.assets.tiles(texture, size, margin, spacing, colorkey)
+
+    def release(self):
+        registry.assets.release_asset(self.texture)
+        registry.assets.release_asset(self.tiles)
 
     @classmethod
     def from_tiled(cls, data, name):
@@ -121,31 +234,147 @@ class Tileset:
 
 
 class Tilemap:
-    def __init__(self, tileset, size, layers):
+    def __init__(self, tileset, size, layers, chunk_size = 16, cache_bytes = 16 * 1024 * 1024):
         self.width, self.height = size
         self.tileset = tileset
         self.layers = layers
-        self.surface = pg.Surface((self.width * tileset.size, self.height * tileset.size), pg.HWSURFACE + pg.SRCALPHA)
-        self.size = self.surface.get_size()
-
-        for layer in range(len(layers)):
-            for j in range(self.height):
-                for i in range(self.width):
-                    id = self.get_at(i, j, layer)
+        self.size = (self.width * tileset.size, self.height * tileset.size)
+        # Pixel offset from Tiled's coordinates to the map's, only infinite maps can start off origin
+        self.offset = (0, 0)
+
+        # Tiles are rendered in chunks of chunk_size x chunk_size tiles when first seen, and the
+        # least recently drawn chunks are dropped once the cache goes over cache_bytes
+        self.chunk_size = chunk_size
+        self.chunk_pixels = chunk_size * tileset.size
+        self.max_chunks = max(1, cache_bytes // (self.chunk_pixels * self.chunk_pixels * 4))
+        self.chunks = OrderedDict()
+
+        # Collision and tag bits of the first layer, one byte per cell; cells is a flat view of the
+        # same memory for fast scalar lookups
+        ids = np.asarray(layers[0], np.int64).reshape(self.height, self.width)
+        self.lookup = np.zeros(max(len(tileset.tiles), int(ids.max(initial = 0))) + 1, np.uint8)
+        for id, tile in tileset.data.items():
+            self.lookup[id + 1] = tile.flags
+        self.flags = self.lookup[ids]
+        self.cells = memoryview(self.flags.reshape(-1))
+
+    def get_chunk(self, cx, cy):
+        key = (cx, cy)
+        if key in self.chunks:
+            self.chunks.move_to_end(key)
+            return self.chunks[key]
+        chunk = self.render_chunk(cx, cy)
+        self.chunks[key] = chunk
+        if len(self.chunks) > self.max_chunks:
+            self.chunks.popitem(last = False)
+        return chunk
+
+    def render_chunk(self, cx, cy):
+        size = self.tileset.size
+        x0, y0 = cx * self.chunk_size, cy * self.chunk_size
+        x1, y1 = min(x0 + self.chunk_size, self.width), min(y0 + self.chunk_size, self.height)
+        blits = []
+        for layer in self.layers:
+            for j in range(y0, y1):
+                row = j * self.width
+                for i in range(x0, x1):
+                    id = layer[row + i]
                     if id != 0:
-                        tile = tileset.tiles[id - 1]
-                        self.surface.blit(tile, (i * tileset.size, j * tileset.size))
+                        blits.append((self.tileset.tiles[id - 1], ((i - x0) * size, (j - y0) * size)))
+        # Chunks without tiles are cached as None so they cost no memory
+        if not blits:
+            return None
+        surface = pg.Surface(((x1 - x0) * size, (y1 - y0) * size), pg.HWSURFACE + pg.SRCALPHA)
+        surface.blits(blits, False)
+        return surface
+
+    def chunks_in(self, area):
+        cx0, cy0 = max(area.left, 0) // self.chunk_pixels, max(area.top, 0) // self.chunk_pixels
+        cx1 = min(area.right - 1, self.size[0] - 1) // self.chunk_pixels
+        cy1 = min(area.bottom - 1, self.size[1] - 1) // self.chunk_pixels
+        return [(cx, cy) for cy in range(cy0, cy1 + 1) for cx in range(cx0, cx1 + 1)]
+
+    def prerender(self, area):
+        for cx, cy in self.chunks_in(area):
+            self.get_chunk(cx, cy)
+
+    def draw(self, surface, area):
+        for cx, cy in self.chunks_in(area):
+            chunk = self.get_chunk(cx, cy)
+            if chunk:
+                surface.blit(chunk, (cx * self.chunk_pixels - area.x, cy * self.chunk_pixels - area.y))
+                profiler.count("blits")
+
+    def stream(self, region):
+        pass
 
     @classmethod
     def from_tiled(cls, data):
         tileset = Tileset.from_tiled(data, "Ground")
-        layers = [l["data"] for l in data["layers"] if l["type"] == "tilelayer"]
+        if data.get("infinite"):
+            return ChunkedTilemap.from_tiled(data, tileset)
+        layers = [
+            memoryview(tiled.decode(l["data"], l.get("encoding"), l.get("compression")))
+            for l in data["layers"] if l["type"] == "tilelayer"
+        ]
         return cls(
             tileset,
             [data["width"], data["height"]],
             layers
         )
 
+    def flags_at(self, x, y):
+        if 0 > x or x >= self.width or 0 > y or y >= self.height:
+            return 0
+        return self.cells[y * self.width + x]
+
+    # Every flag set on cells x0 to x1 of row y, or y0 to y1 of column x, both inclusive. These are
+    # what a box sweeping through the map passes, read one by one so nothing is allocated
+    def flags_in_row(self, y, x0, x1):
+        if 0 > y or y >= self.height:
+            return 0
+        flags = 0
+        cells = self.cells
+        row = y * self.width
+        for i in range(row + max(x0, 0), row + min(x1, self.width - 1) + 1):
+            flags |= cells[i]
+        return flags
+
+    def flags_in_column(self, x, y0, y1):
+        if 0 > x or x >= self.width:
+            return 0
+        flags = 0
+        cells = self.cells
+        width = self.width
+        for i in range(max(y0, 0) * width + x, min(y1, self.height - 1) * width + x + 1, width):
+            flags |= cells[i]
+        return flags
+
+    def flags_at_points(self, xs, ys):
+        xs, ys = np.asarray(xs), np.asarray(ys)
+        inside = (xs >= 0) & (xs < self.width) & (ys >= 0) & (ys < self.height)
+        flags = np.zeros(xs.shape, np.uint8)
+        flags[inside] = self.flags[ys[inside], xs[inside]]
+        return flags
+
+    def flags_in(self, rect):
+        # Every flag set on any cell the pixel rect overlaps
+        size = self.tileset.size
+        x0, y0 = max(rect.left // size, 0), max(rect.top // size, 0)
+        x1, y1 = min((rect.right - 1) // size + 1, self.width), min((rect.bottom - 1) // size + 1, self.height)
+        if x0 >= x1 or y0 >= y1:
+            return 0
+        return int(np.bitwise_or.reduce(self.flags[y0:y1, x0:x1], axis = None))
+
+    def row_span(self, y, x0, x1):
+        # Flags of cells x0..x1 (inclusive) on row y, zero outside the map
+        span = np.zeros(x1 - x0 + 1, np.uint8)
+        if 0 <= y < self.height:
+            start, end = max(x0, 0), min(x1 + 1, self.width)
+            if start < end:
+                span[start - x0:end - x0] = self.flags[y, start:end]
+        return span
+
     def get_info_at(self, x, y, layer = 0):
         return self.get_info(self.get_at(x, y, layer))
 
@@ -161,53 +390,188 @@ class Tilemap:
             return
 
 
+class ChunkedTilemap(Tilemap):
+    # Tilemap of a Tiled infinite map. Every cell starts out empty, chunks are decoded on a
+    # background thread once stream() sees them within prefetch pixels of the region and chunks
+    # inside the region itself are waited for, so nothing collides with a cell still loading
+    def __init__(self, tileset, chunks, bounds, layer_count, prefetch = 512, **kwargs):
+        x0, y0, x1, y1 = bounds
+        self.cell_layers = np.zeros((layer_count, y1 - y0, x1 - x0), np.uint32)
+        Tilemap.__init__(
+            self, tileset, (x1 - x0, y1 - y0),
+            [memoryview(layer.reshape(-1)) for layer in self.cell_layers], **kwargs
+        )
+        self.offset = (-x0 * tileset.size, -y0 * tileset.size)
+        self.prefetch = prefetch
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix = "tilemap")
+        self.loading = {}
+
+        # Chunks waiting to be decoded, indexed by every grid cell of grid x grid tiles they overlap
+        self.pending = {}
+        self.grid = chunks[0][1]["width"] if chunks else 16
+        self.cells_pending = {}
+        for index, chunk, layer in chunks:
+            key = (index, chunk["x"] - x0, chunk["y"] - y0)
+            self.pending[key] = (chunk, layer)
+            for cell in self.grid_cells(key[1], key[2], chunk["width"], chunk["height"]):
+                self.cells_pending.setdefault(cell, []).append(key)
+
+    def grid_cells(self, x, y, w, h):
+        return [
+            (i, j)
+            for j in range(y // self.grid, (y + h - 1) // self.grid + 1)
+            for i in range(x // self.grid, (x + w - 1) // self.grid + 1)
+        ]
+
+    def stream(self, region):
+        size = self.tileset.size
+        near = region.inflate(2 * self.prefetch, 2 * self.prefetch)
+        for cell in self.grid_cells(near.x // size, near.y // size, near.w // size + 1, near.h // size + 1):
+            for key in self.cells_pending.pop(cell, []):
+                if key in self.pending:
+                    chunk, layer = self.pending.pop(key)
+                    self.loading[key] = (chunk, self.executor.submit(tiled.decode_chunk, chunk, layer))
+
+        for key, (chunk, future) in list(self.loading.items()):
+            index, x, y = key
+            inside = region.colliderect((x * size, y * size, chunk["width"] * size, chunk["height"] * size))
+            if inside or future.done():
+                self.load_cells(index, x, y, future.result())
+                del self.loading[key]
+                profiler.count("chunks")
+
+    def load_cells(self, layer, x, y, ids):
+        h, w = ids.shape
+        self.cell_layers[layer, y:y + h, x:x + w] = ids
+        if layer == 0:
+            top = int(ids.max(initial = 0))
+            if top >= len(self.lookup):
+                self.lookup = np.concatenate([self.lookup, np.zeros(top + 1 - len(self.lookup), np.uint8)])
+            self.flags[y:y + h, x:x + w] = self.lookup[ids]
+        # Rendered chunks are drawn again with the new tiles
+        for cy in range(y // self.chunk_size, (y + h - 1) // self.chunk_size + 1):
+            for cx in range(x // self.chunk_size, (x + w - 1) // self.chunk_size + 1):
+                self.chunks.pop((cx, cy), None)
+
+    @classmethod
+    def from_tiled(cls, data, tileset):
+        chunks, bounds = tiled.chunks(data)
+        return cls(tileset, chunks, bounds, len([l for l in data["layers"] if l["type"] == "tilelayer"]))
+
+
+def flip_variant(flip_h, flip_v):
+    return flip_h + 2 * flip_v
+
+
 class Spritesheet:
     def __init__(self, texture, size):
-        self.texture = pg.image.load(texture).convert_alpha()
+        self.texture = registry.assets.texture(texture)
         self.sprites = []
         width, height = size
         for j in range(0, self.texture.get_height(), height):
             for i in range(0, self.texture.get_width(), width):
                 clip = pg.Rect(i, j, width, height)
                 self.sprites.append(self.texture.subsurface(clip))
+        # Flipped copies (h, v, hv) are made the first time each frame is drawn that way
+        self.variants = [self.sprites] + [[None] * len(self.sprites) for _ in range(3)]
+
+    def get(self, index, flip_h = False, flip_v = False):
+        variant = self.variants[flip_variant(flip_h, flip_v)]
+        sprite = variant[index]
+        if sprite is None:
+            sprite = variant[index] = pg.transform.flip(self.sprites[index], flip_h, flip_v)
+        return sprite
 
 
 class Sprite:
+    __slots__ = ("texture", "flip_h", "flip_v", "variants")
+
     def __init__(self, texture):
-        self.texture = pg.image.load(texture).convert_alpha() if texture else None
+        self.texture = registry.assets.texture(texture) if texture else None
         self.flip_h = False
         self.flip_v = False
+        self.variants = [self.texture, None, None, None]
+
+    def get_texture(self):
+        variant = flip_variant(self.flip_h, self.flip_v)
+        texture = self.variants[variant]
+        if texture is None:
+            texture = self.variants[variant] = pg.transform.flip(self.texture, self.flip_h, self.flip_v)
+        return texture
 
     def draw(self, surface, position = (0, 0)):
-        surface.blit(pg.transform.flip(self.texture, self.flip_h, self.flip_v), position)
+        surface.blit(self.get_texture(), position)
+        profiler.count("blits")
+
+
+# Animations of an entity type as tables shared by all its sprites: per animation the frames
+# and the frame count at which each of them ends
+class Animations:
+    def __init__(self, frames):
+        self.names = list(frames)
+        self.tables = {}
+        for animation, data in frames.items():
+            self.tables[animation] = (
+                tuple(section["frame"] for section in data),
+                tuple(accumulate(section["duration"] for section in data))
+            )
 
 
 class AnimatedSprite(Sprite):
-    def __init__(self, spritesheet, frames, default):
-        Sprite.__init__(self, None)
+    __slots__ = ("spritesheet", "animations", "current", "queue", "frame", "index")
+
+    def __init__(self, spritesheet, animations, default):
         self.spritesheet = spritesheet
-        self.animations = {}
+        self.animations = animations if isinstance(animations, Animations) else Animations(animations)
+        self.reset(default)
+
+    def reset(self, default):
+        self.flip_h = False
+        self.flip_v = False
         self.current = None
         self.queue = default
         self.frame = 0
-
-        for animation, data in frames.items():
-            self.animations[animation] = []
-            for section in data:
-                self.animations[animation].extend([section["frame"]] * section["duration"])
+        # Sprites that are never processed (e.g. asleep outside the camera) still have something to draw
+        self.index = self.animations.tables[default][0][0]
+        self.texture = self.spritesheet.sprites[self.index]
 
     def next(self):
+        frames, ends = self.animations.tables[self.queue]
         if self.queue != self.current:
             self.current = self.queue
             self.frame = 0
-        elif self.frame >= len(self.animations[self.current]):
+        elif self.frame >= ends[-1]:
             self.frame = 0
-        self.texture = self.spritesheet.sprites[self.animations[self.current][self.frame]]
+        self.index = frames[bisect_right(ends, self.frame)]
+        self.texture = self.spritesheet.sprites[self.index]
         self.frame += 1
 
+    def get_texture(self):
+        return self.spritesheet.get(self.index, self.flip_h, self.flip_v)
+
     def play(self, animation):
         self.queue = animation
 
+    def save(self, out):
+        # Animations are saved as their position in animations, -1 for none
+        names = self.animations.names
+        out += (
+            names.index(self.current) if self.current in names else -1, names.index(self.queue),
+            self.frame, self.index, self.flip_h, self.flip_v
+        )
+
+    def load(self, values, i):
+        current, queue, frame, index, flip_h, flip_v = values[i:i + 6]
+        names = self.animations.names
+        self.current = names[int(current)] if current >= 0 else None
+        self.queue = names[int(queue)]
+        self.frame = int(frame)
+        self.index = int(index)
+        self.flip_h = bool(flip_h)
+        self.flip_v = bool(flip_v)
+        self.texture = self.spritesheet.sprites[self.index]
+        return i + 6
+
 
 class Camera:
     def __init__(self, size, limits):
@@ -231,21 +595,161 @@ class Camera:
             v_limit = True
         return h_limit, v_limit
 
-    def draw(self, surface, layers):
+    def draw(self, surface, layers, area = None):
+        area = area or self.shape
         for layer in layers:
-            surface.blit(layer.subsurface(self.shape), (0,0))
+            if isinstance(layer, pg.Surface):
+                surface.blit(layer.subsurface(area), (0,0))
+                profiler.count("blits")
+            else:
+                layer.draw(surface, area)
+
+
+class SpatialHash:
+    def __init__(self, cell = 64):
+        self.cell = cell
+        self.cells = {}
+        self.bounds = {}
+        self.order = {}
+
+    def cells_for(self, rect):
+        return (
+            rect.left // self.cell, rect.top // self.cell,
+            (rect.right - 1) // self.cell, (rect.bottom - 1) // self.cell
+        )
+
+    def insert(self, entity):
+        self.order[entity] = len(self.order)
+        self.bounds[entity] = None
+        self.update(entity)
+
+    def remove(self, entity):
+        bounds = self.bounds.pop(entity)
+        self.order.pop(entity)
+        if bounds:
+            self.unlink(entity, bounds)
+
+    def update(self, entity):
+        bounds = self.cells_for(entity.shape)
+        previous = self.bounds[entity]
+        if bounds == previous:
+            return
+        if previous:
+            self.unlink(entity, previous)
+        x0, y0, x1, y1 = bounds
+        for j in range(y0, y1 + 1):
+            for i in range(x0, x1 + 1):
+                cell = self.cells.get((i, j))
+                if cell is None:
+                    cell = self.cells[(i, j)] = []
+                cell.append(entity)
+        self.bounds[entity] = bounds
+
+    def unlink(self, entity, bounds):
+        x0, y0, x1, y1 = bounds
+        for j in range(y0, y1 + 1):
+            for i in range(x0, x1 + 1):
+                cell = self.cells[(i, j)]
+                cell.remove(entity)
+                if not cell:
+                    del self.cells[(i, j)]
+
+    def query(self, rect):
+        x0, y0, x1, y1 = self.cells_for(rect)
+        found = set()
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > len(self.cells):
+            for (i, j), cell in self.cells.items():
+                if x0 <= i <= x1 and y0 <= j <= y1:
+                    found.update(cell)
+            return found
+        for j in range(y0, y1 + 1):
+            for i in range(x0, x1 + 1):
+                found.update(self.cells.get((i, j), ()))
+        return found
+
+    def collide(self, rect, exclude = None):
+        # The first colliding entity in insertion order, same as collidelist over a list
+        x0, y0, x1, y1 = self.cells_for(rect)
+        found = None
+        index = None
+        checks = 0
+        for j in range(y0, y1 + 1):
+            for i in range(x0, x1 + 1):
+                for entity in self.cells.get((i, j), ()):
+                    checks += 1
+                    if entity is exclude or not entity.enabled_collisions:
+                        continue
+                    order = self.order[entity]
+                    if (index is None or order < index) and rect.colliderect(entity.shape):
+                        found = entity
+                        index = order
+        profiler.count("collisions", checks)
+        return found
+
+
+# Scratch rect move_and_collide tests entities against, bodies are only moved on one thread
+PROBE = pg.Rect(0, 0, 0, 0)
+# Sides of a Kinematic that colliding can hold a body for
+SIDES = ("top", "bottom", "left", "right")
+NOT_COLLIDING = (-1, -1, -1, -1)
 
 
 class Kinematic:
+    # "camera" sleeps outside the level activation region, "wake" never sleeps again once
+    # it has been activated and "always" is simulated everywhere
+    activation = "camera"
+    __slots__ = ("shape", "position", "velocity", "grounded", "gravity", "colliding", "enabled_collisions")
+
     def __init__(self, size, position, gravity = True):
-        self.shape = pg.Rect(position[0], position[1], size[0], size[1])
-        self.position = pg.Vector2(position[0], position[1])
-        self.velocity = pg.Vector2(0)
+        self.shape = pg.Rect(0, 0, size[0], size[1])
+        self.position = pg.Vector2()
+        self.velocity = pg.Vector2()
+        Kinematic.reset(self, position, gravity)
+
+    def reset(self, position, gravity = True):
+        # Puts the body back the way __init__ leaves it, so it can be reused instead of replaced
+        self.shape.x = int(position[0])
+        self.shape.y = int(position[1])
+        self.position.update(position[0], position[1])
+        self.velocity.update(0)
         self.grounded = False
         self.gravity = gravity
         self.colliding = {}
         self.enabled_collisions = True
 
+    def save(self, out, level):
+        # Appends the body's state to out as numbers, bodies it touches as their index in
+        # level.ids (-1 for none). load reads the same values back from i and returns where they end
+        colliding = self.colliding
+        ids = level.ids
+        out += (
+            self.position.x, self.position.y, self.velocity.x, self.velocity.y, self.shape.x, self.shape.y,
+            self.grounded, self.gravity, self.enabled_collisions
+        )
+        if colliding:
+            out += [ids[colliding[side]] if side in colliding else -1 for side in SIDES]
+        else:
+            out += NOT_COLLIDING
+
+    def load(self, values, i, level):
+        self.position.x, self.position.y, self.velocity.x, self.velocity.y, x, y, grounded, gravity, enabled = values[i:i + 9]
+        self.shape.x = int(x)
+        self.shape.y = int(y)
+        self.grounded = bool(grounded)
+        self.gravity = bool(gravity)
+        self.enabled_collisions = bool(enabled)
+        sides = values[i + 9:i + 13]
+        if sides == NOT_COLLIDING:
+            self.colliding = {}
+        else:
+            bodies = level.bodies
+            self.colliding = {side: bodies[int(id)] for side, id in zip(SIDES, sides) if id >= 0}
+        return i + 13
+
+    def free(self):
+        # Releases the assets the body holds once it is dropped for good rather than reused
+        pass
+
     def apply_gravity(self):
         if self.gravity:
             self.velocity.y = min(self.velocity.y + 0.2, 10)
@@ -255,44 +759,51 @@ class Kinematic:
         self.shape.x = int(self.position.x)
         self.shape.y = int(self.position.y)
 
-    def move_and_collide(self, dt, tilemap, entities = []):
-        self.colliding = {}
-        rects = [entity.shape.copy() if entity.shape is not self.shape and entity.enabled_collisions else pg.Rect(0,0,0,0) for entity in entities]
-
-        self.position.x += self.velocity.x
-        self.shape.x = int(self.position.x)
-
-        if self.velocity.x > 0:
-            points = [self.shape.topright, self.shape.midright, self.shape.bottomright]
-            for point in points:
-                x = point[0] // 16
-                y = point[1] // 16
-                tile = tilemap.get_info_at(x, y)
-                if tile and tile.type == "solid":
-                    if self.shape.right >= x * 16 and self.shape.bottom != y * 16 and self.shape.top != y * 16 + 16:
-                        self.shape.right = x * 16
-                        self.position.x = self.shape.x
-                        self.velocity.x = 0
+    def collide(self, shape, entities):
+        if isinstance(entities, SpatialHash):
+            return entities.collide(shape, self)
+        profiler.count("collisions", len(entities))
+        for entity in entities:
+            if entity.shape is not self.shape and entity.enabled_collisions and shape.colliderect(entity.shape):
+                return entity
 
+    def move_and_collide(self, dt, tilemap, entities = []):
+        # Tiles are swept: each axis tests every column or row of cells the leading edge passes
+        # through on the way, so a body stops at the first solid one however fast it moves
+        self.colliding.clear()
+        shape = self.shape
+        position = self.position
+        velocity = self.velocity
+
+        left, right = shape.left, shape.right
+        position.x += velocity.x
+        shape.x = int(position.x)
+        y0, y1 = shape.top // 16, (shape.bottom - 1) // 16
+
+        # The columns the leading edge enters, from the first one it does not already overlap, and
+        # always the one it ends in. Moving right a wall that is only touched still stops the body,
+        # moving left it has to overlap
+        if velocity.x > 0:
+            end = shape.right // 16
+            swept = range(min((right - 1) // 16 + 1, end), end + 1)
         else:
-            points = [self.shape.topleft, self.shape.midleft, self.shape.bottomleft]
-            for point in points:
-                x = point[0] // 16
-                y = point[1] // 16
-                tile = tilemap.get_info_at(x, y)
-                if tile and tile.type == "solid":
-                    if self.shape.left <= x * 16 + 16 and self.shape.bottom != y * 16 and self.shape.top != y * 16 + 16:
-                        self.shape.left = x * 16 + 16
-                        self.position.x = self.shape.x
-                        self.velocity.x = 0
+            end = shape.left // 16
+            swept = range(max(left // 16 - 1, end), end - 1, -1)
+        for x in swept:
+            if tilemap.flags_in_column(x, y0, y1) & SOLID:
+                if velocity.x > 0:
+                    shape.right = x * 16
+                else:
+                    shape.left = x * 16 + 16
+                position.x = shape.x
+                velocity.x = 0
+                break
+        profiler.count("collisions", len(swept))
 
-        shape = self.shape.copy()
-        shape.y += 4
-        shape.h -= 8
-        index = shape.collidelist(rects)
-        if index != -1:
-            rect = rects[index]
-            entity = entities[index]
+        PROBE.update(shape.x, shape.y + 4, shape.w, shape.h - 8)
+        entity = self.collide(PROBE, entities)
+        if entity:
+            rect = entity.shape
             if entity.velocity.x > 0:
                 if self.shape.x > rect.x:
                     self.shape.left = rect.right
@@ -333,54 +844,42 @@ class Kinematic:
                     self.velocity.x = 0
                     self.colliding["right"] = entity
 
-        self.position.y += self.velocity.y
-        self.shape.y = int(self.position.y)
+        top, bottom = shape.top, shape.bottom
+        position.y += velocity.y
+        shape.y = int(position.y)
+        # A body that was on the ground reaches 4 pixels further down, so it keeps to the ground and
+        # to blocks moving down under it
         snap = self.grounded
         self.grounded = False
-
-        if self.velocity.y > 0:
-            points = [self.shape.bottomleft, self.shape.midbottom, self.shape.bottomright]
-            for point in points:
-                x = point[0] // 16
-                if snap:
-                    y = (point[1] + 4) // 16
-                    bottom = self.shape.bottom + 4
-                else:
-                    y = point[1] // 16
-                    bottom = self.shape.bottom
-                tile = tilemap.get_info_at(x, y)
-                if tile:
-                    if tile.type == "solid" and bottom >= y * 16 and self.shape.right != x * 16 and self.shape.left != x * 16 + 16:
-                        self.shape.bottom = y * 16
-                        self.grounded = True
-                        self.position.y = self.shape.y
-                        self.velocity.y = 0
-                    elif tile.type == "semisolid" and y * 16 + 8 >= bottom >= y * 16 and self.shape.right != x * 16 and self.shape.left != x * 16 + 16:
-                        self.shape.bottom = y * 16
-                        self.grounded = True
-                        self.position.y = self.shape.y
-                        self.velocity.y = 0
-
+        x0, x1 = shape.left // 16, (shape.right - 1) // 16
+
+        if velocity.y > 0:
+            # Semisolid tiles only catch bodies that were no lower than their top 8 pixels
+            end = (shape.bottom + 4 if snap else shape.bottom) // 16
+            swept = range(min((bottom - 1) // 16 + 1, end), end + 1)
+            for y in swept:
+                flags = tilemap.flags_in_row(y, x0, x1)
+                if flags & SOLID or flags & SEMISOLID and bottom <= y * 16 + 8:
+                    shape.bottom = y * 16
+                    self.grounded = True
+                    position.y = shape.y
+                    velocity.y = 0
+                    break
         else:
-            points = [self.shape.topleft, self.shape.midtop, self.shape.topright]
-            for point in points:
-                x = point[0] // 16
-                y = point[1] // 16
-                tile = tilemap.get_info_at(x, y)
-                if tile and tile.type == "solid":
-                    if self.shape.top <= y * 16 + 16 and self.shape.right != x * 16 and self.shape.left != x * 16 + 16:
-                        self.shape.top = y * 16 + 16
-                        self.position.y = self.shape.y
-                        self.velocity.y = 1
-
-        shape = self.shape.copy()
-        shape.x += 4
-        shape.w -= 8
-        if snap: shape.h += 4
-        index = shape.collidelist(rects)
-        if index != -1:
-            rect = rects[index]
-            entity = entities[index]
+            end = shape.top // 16
+            swept = range(max(top // 16 - 1, end), end - 1, -1)
+            for y in swept:
+                if tilemap.flags_in_row(y, x0, x1) & SOLID:
+                    shape.top = y * 16 + 16
+                    position.y = shape.y
+                    velocity.y = 1
+                    break
+        profiler.count("collisions", len(swept))
+
+        PROBE.update(shape.x + 4, shape.y, shape.w - 8, shape.h + 4 if snap else shape.h)
+        entity = self.collide(PROBE, entities)
+        if entity:
+            rect = entity.shape
             if entity.velocity.y > 0:
                 if self.shape.y > rect.y:
                     self.shape.top = rect.bottom
@@ -426,3 +925,30 @@ class Kinematic:
             if self.grounded:
                 self.position.x += entity.velocity.x
                 self.shape.x = int(self.position.x)
+
+
+# Spare instances of cls to use again instead of allocating new ones. spawn hands one out through
+# its reset method, with the arguments __init__ would take, or makes a new one when none are left.
+# Instances keep the assets they hold while pooled, ones beyond limit are freed instead
+class Pool:
+    def __init__(self, cls, limit = 4096):
+        self.cls = cls
+        self.limit = limit
+        self.free = []
+
+    def __len__(self):
+        return len(self.free)
+
+    def spawn(self, *args):
+        try:
+            instance = self.free.pop()
+        except IndexError:
+            return self.cls(*args)
+        instance.reset(*args)
+        return instance
+
+    def release(self, instance):
+        if len(self.free) < self.limit:
+            self.free.append(instance)
+        else:
+            instance.free()
@@ -0,0 +1,135 @@
+import json, time
+from collections import deque
+import nodes, registry
+
+
+current = None
+
+
+def count(name, n = 1):
+    if current:
+        current.counters[name] = current.counters.get(name, 0) + n
+
+
+def percentile(samples, p):
+    if not samples:
+        return 0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+class Profiler:
+    def __init__(self, window = 600, budget = 1 / 60, trace_frames = 0, overlay = False):
+        self.window = window
+        self.budget = budget
+        self.overlay = overlay
+        self.font = None
+        self.lines = []
+
+        self.frames = deque(maxlen = window)
+        self.phases = {}
+        self.counters = {}
+        self.frame_counters = {}
+        self.frame = 0
+        self.slow_frames = 0
+
+        self.origin = time.perf_counter()
+        self.trace = deque(maxlen = trace_frames) if trace_frames else None
+        self.current_trace = []
+        self.frame_start = 0
+        self.last = 0
+
+    def enable(self):
+        global current
+        current = self
+
+    def disable(self):
+        global current
+        if current is self:
+            current = None
+
+    def begin(self):
+        self.counters = {}
+        self.current_trace = []
+        self.frame_start = self.last = time.perf_counter()
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        duration = now - self.last
+        samples = self.phases.get(phase)
+        if samples is None:
+            samples = self.phases[phase] = deque(maxlen = self.window)
+        samples.append(duration)
+        if self.trace is not None:
+            self.current_trace.append((phase, self.last, duration))
+        self.last = now
+
+    def end(self):
+        duration = time.perf_counter() - self.frame_start
+        self.frames.append(duration)
+        self.frame_counters = self.counters
+        if duration > self.budget:
+            self.slow_frames += 1
+        if self.trace is not None:
+            self.trace.append((self.frame, self.frame_start, duration, self.current_trace, self.counters))
+        self.frame += 1
+
+    def stats(self):
+        return {
+            "frames": self.frame,
+            "slow_frames": self.slow_frames,
+            "frame": self.summary(self.frames),
+            "histogram": self.histogram(),
+            "phases": {phase: self.summary(samples) for phase, samples in self.phases.items()},
+            "counters": dict(self.frame_counters)
+        }
+
+    def summary(self, samples):
+        return {
+            "p50_ms": percentile(samples, 0.5) * 1000,
+            "p95_ms": percentile(samples, 0.95) * 1000,
+            "p99_ms": percentile(samples, 0.99) * 1000
+        }
+
+    def histogram(self, bucket_ms = 1, buckets = 34):
+        histogram = [0] * buckets
+        for sample in self.frames:
+            histogram[min(buckets - 1, int(sample * 1000 / bucket_ms))] += 1
+        return histogram
+
+    def export_trace(self, file):
+        events = []
+        for frame, start, duration, phases, counters in self.trace or []:
+            events.append({
+                "name": "frame", "ph": "X", "pid": 0, "tid": 0,
+                "ts": (start - self.origin) * 1e6, "dur": duration * 1e6,
+                "args": {"frame": frame, "over_budget": duration > self.budget}
+            })
+            for phase, phase_start, phase_duration in phases:
+                events.append({
+                    "name": phase, "ph": "X", "pid": 0, "tid": 0,
+                    "ts": (phase_start - self.origin) * 1e6, "dur": phase_duration * 1e6
+                })
+            if counters:
+                events.append({
+                    "name": "counters", "ph": "C", "pid": 0, "tid": 0,
+                    "ts": (start - self.origin) * 1e6, "args": counters
+                })
+        with open(file, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def draw(self, surface):
+        if not self.font:
+            self.font = registry.assets.font("assets/font.png", (8, 8), nodes.FONT_CHARACTERS)
+        # Percentiles are only recomputed a few times per second to keep the overlay cheap
+        if self.frame % 15 == 0 or not self.lines:
+            frame = self.summary(self.frames)
+            self.lines = [
+                self.font.write("FRAME %.1f P95 %.1f P99 %.1f" % (frame["p50_ms"], frame["p95_ms"], frame["p99_ms"]))
+            ]
+            for phase, samples in self.phases.items():
+                self.lines.append(self.font.write("%s %.2f" % (phase.upper(), percentile(samples, 0.5) * 1000)))
+            for name, value in sorted(self.frame_counters.items()):
+                self.lines.append(self.font.write("%s %d" % (name.upper(), value)))
+        for y, line in enumerate(self.lines):
+            surface.blit(line, (2, 2 + y * 9))
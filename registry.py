@@ -0,0 +1,119 @@
+import pygame as pg
+import nodes, utils, threading
+
+
+class AssetRegistry:
+    def __init__(self):
+        self.assets = {}
+        self.references = {}
+        self.dependencies = {}
+        # Key of every loaded asset by id, so owners can release what they were handed
+        self.keys = {}
+        self.loading = []
+        self.hits = 0
+        self.misses = 0
+        # Levels can be loaded on a worker thread while the game plays, loads are serialized so
+        # the loading stack only ever belongs to one thread
+        self.lock = threading.RLock()
+
+    def get(self, key, loader):
+        with self.lock:
+            if self.loading:
+                self.dependencies[self.loading[-1]].append(key)
+            asset = self.assets.get(key)
+            if asset is None:
+                self.misses += 1
+                self.dependencies[key] = []
+                self.loading.append(key)
+                try:
+                    asset = loader()
+                finally:
+                    self.loading.pop()
+                self.assets[key] = asset
+                self.keys[id(asset)] = key
+            else:
+                self.hits += 1
+            self.references[key] = self.references.get(key, 0) + 1
+            return asset
+
+    def texture(self, path, colorkey = None):
+        def load():
+            texture = pg.image.load(path).convert_alpha()
+            if colorkey is not None:
+                texture.set_colorkey(colorkey)
+            return texture
+        return self.get(("texture", path, colorkey), load)
+
+    def tiles(self, path, size, margin = 0, spacing = 0, colorkey = None):
+        def load():
+            texture = self.texture(path, colorkey)
+            tiles = []
+            for j in range(margin, texture.get_height(), size + spacing):
+                for i in range(margin, texture.get_width(), size + spacing):
+                    tiles.append(texture.subsurface(pg.Rect(i, j, size, size)))
+            return tiles
+        return self.get(("tiles", path, size, margin, spacing, colorkey), load)
+
+    def spritesheet(self, path, size):
+        return self.get(("spritesheet", path, tuple(size)), lambda: nodes.Spritesheet(path, size))
+
+    def font(self, path, size, characters):
+        return self.get(("font", path, tuple(size), characters), lambda: nodes.Font(path, size, characters))
+
+    def preload(self, manifest):
+        # A manifest is a list (or a JSON file with a list) of {"type": ..., **arguments} entries,
+        # every entry keeps a reference until it is released
+        if isinstance(manifest, str):
+            manifest = utils.load_json(manifest)
+        for entry in manifest:
+            arguments = {k: v for k, v in entry.items() if k != "type"}
+            if isinstance(arguments.get("size"), list):
+                arguments["size"] = tuple(arguments["size"])
+            getattr(self, entry["type"])(**arguments)
+
+    def release(self, key):
+        with self.lock:
+            references = self.references.get(key, 0) - 1
+            if references > 0:
+                self.references[key] = references
+            else:
+                self.references.pop(key, None)
+
+    def release_asset(self, asset):
+        # Releases a reference taken through one of the loaders above, by the asset it returned
+        with self.lock:
+            key = self.keys.get(id(asset))
+            if key is not None:
+                self.release(key)
+
+    def collect(self):
+        with self.lock:
+            # Freeing an asset releases what it was built from, which may free more assets
+            freed = 0
+            unused = [key for key in self.assets if key not in self.references]
+            while unused:
+                for key in unused:
+                    self.keys.pop(id(self.assets.pop(key)), None)
+                    for dependency in self.dependencies.pop(key, []):
+                        self.release(dependency)
+                freed += len(unused)
+                unused = [key for key in self.assets if key not in self.references]
+            return freed
+
+    def clear(self):
+        with self.lock:
+            self.assets = {}
+            self.references = {}
+            self.dependencies = {}
+            self.keys = {}
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "loaded": len(self.assets),
+            "referenced": len(self.references)
+        }
+
+
+assets = AssetRegistry()
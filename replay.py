@@ -0,0 +1,82 @@
+import struct, random
+
+
+# A session log is a header followed by one fixed size record per simulation step: bitmasks of the
+# pressed, just pressed and just released actions, and a checksum of the world after that step.
+# The header keeps the rewind capacity too, since holding rewind only replays the same way with it
+MAGIC = b"SMWR"
+VERSION = 2
+HEADER = struct.Struct("<4sHIIH")
+RECORD = struct.Struct("<HHHI")
+
+
+class Recorder:
+    def __init__(self, path, actions, seed = 0, rewind = 0):
+        self.actions = list(actions)
+        self.bits = {action: 1 << i for i, action in enumerate(self.actions)}
+        names = ",".join(self.actions).encode()
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION, seed, rewind, len(names)) + names)
+        self.frames = 0
+
+    def mask(self, actions):
+        mask = 0
+        for action in actions:
+            mask |= self.bits.get(action, 0)
+        return mask
+
+    def write(self, events, checksum = 0):
+        self.file.write(RECORD.pack(
+            self.mask(events.pressed), self.mask(events.just_pressed), self.mask(events.just_released),
+            checksum & 0xFFFFFFFF
+        ))
+        self.frames += 1
+
+    def close(self):
+        self.file.close()
+
+
+class Replay:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, version, self.seed, self.rewind, length = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} session log")
+        start = HEADER.size + length
+        self.actions = data[HEADER.size:start].decode().split(",") if length else []
+        # A session that was killed mid-write can end in a partial record, which is dropped
+        end = start + (len(data) - start) // RECORD.size * RECORD.size
+        self.records = list(RECORD.iter_unpack(data[start:end]))
+        self.index = 0
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.index >= len(self.records):
+            raise StopIteration
+        pressed, just_pressed, just_released, _ = self.records[self.index]
+        self.index += 1
+        return self.unmask(pressed), self.unmask(just_pressed), self.unmask(just_released)
+
+    def unmask(self, mask):
+        return [action for i, action in enumerate(self.actions) if mask >> i & 1]
+
+    def checksum(self, index):
+        return self.records[index][3]
+
+
+def verify(engine, replay):
+    # Plays the whole log through a headless engine, returns the first step whose world checksum
+    # differs from the recording or None when every step matches
+    random.seed(replay.seed)
+    engine.replay = replay
+    for index in range(len(replay)):
+        engine.step()
+        if engine.root.checksum() & 0xFFFFFFFF != replay.checksum(index):
+            return index
+    return None
@@ -0,0 +1,36 @@
+# The last capacity snapshots of a level, one per step, in a single buffer allocated up front.
+# Once it is full each new snapshot overwrites the oldest one
+class Rewind:
+    def __init__(self, capacity = 600):
+        self.capacity = capacity
+        self.size = 0
+        self.buffer = bytearray()
+        self.head = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        self.count = 0
+
+    def record(self, level):
+        size = level.snapshot_size()
+        if size != self.size:
+            self.size = size
+            self.buffer = bytearray(size * self.capacity)
+            self.count = 0
+        level.snapshot(self.buffer, self.head * size)
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def back(self, level, frames = 1):
+        # Restores level to frames steps before the last snapshot, or as far as the history goes,
+        # and forgets the snapshots after it. False when there is nothing older to go back to
+        frames = min(frames, self.count - 1)
+        if frames <= 0:
+            return False
+        self.head = (self.head - frames) % self.capacity
+        self.count -= frames
+        level.restore(self.buffer, (self.head - 1) % self.capacity * self.size)
+        return True
@@ -1,4 +1,5 @@
 import pygame as pg
+import random
 from nodes import State
 
 
@@ -108,3 +109,28 @@ class ClimbMove(State):
 
     def exit(self, entity):
         entity.gravity = True
+
+
+class Patrol(State):
+    def __init__(self, states):
+        State.__init__(self, [Squashed], states)
+
+
+class Squashed(State):
+    def __init__(self, states):
+        State.__init__(self, [Knocked], states)
+
+    def enter(self, entity):
+        entity.sprite.flip_v = True
+        entity.velocity.x = 0
+        entity.enabled = False
+
+
+class Knocked(State):
+    def __init__(self, states):
+        State.__init__(self, [], states)
+
+    def enter(self, entity):
+        entity.dead = True
+        entity.velocity.y = -5
+        entity.velocity.x = random.randint(-1, 1)
@@ -0,0 +1,46 @@
+import base64, gzip, zlib
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def decode(data, encoding = None, compression = None):
+    # Tile ids of a Tiled layer or chunk "data" field as a flat uint32 array, data is either a
+    # plain list or a base64 string of little endian ids, optionally zlib, gzip or zstd compressed
+    if encoding != "base64":
+        return np.asarray(data, np.uint32)
+    raw = base64.b64decode(data)
+    if compression == "zlib":
+        raw = zlib.decompress(raw)
+    elif compression == "gzip":
+        raw = gzip.decompress(raw)
+    elif compression == "zstd":
+        if zstandard is None:
+            raise ImportError("zstd compressed maps need the zstandard package")
+        raw = zstandard.ZstdDecompressor().decompressobj().decompress(raw)
+    elif compression:
+        raise ValueError(f"unsupported tile layer compression {compression}")
+    return np.frombuffer(raw, "<u4").astype(np.uint32)
+
+
+def chunks(data):
+    # Every chunk of the tile layers of an infinite map as (layer index, chunk, layer), plus the
+    # bounds (x0, y0, x1, y1) in tiles that they cover
+    found = []
+    for index, layer in enumerate(l for l in data["layers"] if l["type"] == "tilelayer"):
+        for chunk in layer["chunks"]:
+            found.append((index, chunk, layer))
+    if not found:
+        return found, (0, 0, 0, 0)
+    return found, (
+        min(chunk["x"] for _, chunk, _ in found), min(chunk["y"] for _, chunk, _ in found),
+        max(chunk["x"] + chunk["width"] for _, chunk, _ in found),
+        max(chunk["y"] + chunk["height"] for _, chunk, _ in found)
+    )
+
+
+def decode_chunk(chunk, layer):
+    return decode(chunk["data"], layer.get("encoding"), layer.get("compression")).reshape(chunk["height"], chunk["width"])
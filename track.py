@@ -0,0 +1,48 @@
+import pygame as pg
+
+
+class Track:
+    def __init__(self, points):
+        self.points = [pg.Vector2(point) for point in points]
+        # Per segment, from point i to i + 1: unit direction, length and arc length at its start
+        self.directions = []
+        self.lengths = []
+        self.arc = [0.0]
+        for start, end in zip(self.points, self.points[1:]):
+            segment = end - start
+            length = segment.length()
+            self.directions.append(segment / length if length else pg.Vector2(0, 0))
+            self.lengths.append(length)
+            self.arc.append(self.arc[-1] + length)
+
+    def __len__(self):
+        return len(self.points)
+
+    @property
+    def length(self):
+        return self.arc[-1]
+
+
+class TrackNetwork:
+    def __init__(self, tracks, cell = 16):
+        self.tracks = tracks
+        self.cell = cell
+        # Points that sit at the center of a tile, by tile. When tracks share a point the first
+        # track and the first index on it win
+        self.points = {}
+        for track in tracks:
+            for index, point in enumerate(track.points):
+                key = (int(point.x // cell), int(point.y // cell))
+                if point == self.center(*key):
+                    self.points.setdefault(key, (track, index))
+
+    @classmethod
+    def from_polylines(cls, polylines):
+        return cls([Track(points) for points in polylines if points])
+
+    def center(self, x, y):
+        return pg.Vector2(x * self.cell + self.cell // 2, y * self.cell + self.cell // 2)
+
+    def at(self, position):
+        # Track and point index at the center of the tile position is in, or None
+        return self.points.get((int(position[0] // self.cell), int(position[1] // self.cell)))
@@ -7,3 +7,16 @@ def load_json(file):
 
 def clamp(number, floor, ceil):
     return max(floor, min(number, ceil))
+
+def lerp(a, b, t):
+    return a + (b - a) * t
+
+def summarize(samples):
+    samples = sorted(samples)
+    n = len(samples)
+    return {
+        "mean_ms": sum(samples) / n * 1000,
+        "p50_ms": samples[n // 2] * 1000,
+        "p95_ms": samples[min(n - 1, int(n * 0.95))] * 1000,
+        "max_ms": samples[-1] * 1000
+    }